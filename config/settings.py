@@ -48,10 +48,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.CurrentWorkspaceMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -176,3 +178,31 @@ PUBLIC_EMAIL_DOMAINS = {
     # add more as needed
 }
 
+
+# Label rendering: when true, generate pages queue a RenderJob and return at once;
+# `python manage.py run_render_workers` (Procfile "worker") renders it.
+LABELS_RENDER_ASYNC = os.getenv("LABELS_RENDER_ASYNC", "False").lower() == "true"
+
+# Per-stage render timing (labels.timing): histograms at /labels/timings/ for staff,
+# and a Server-Timing header on generate responses. Off by default.
+LABELS_RENDER_TIMING = os.getenv("LABELS_RENDER_TIMING", "False").lower() == "true"
+
+# SQL query budgets per view (core.middleware.QueryBudgetMiddleware), by URL name.
+# Going over, or repeating one statement QUERY_REPEAT_THRESHOLD+ times (N+1), is
+# logged to "core.queries"; with QUERY_BUDGET_STRICT it raises instead. The test runner
+# (core.test_runner) turns strict mode on, so an N+1 fails the test.
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "25"))
+# Budgets are the measured worst case (in comments) plus a little headroom. Bulk generate
+# is counted as the statements outside its batches plus its largest batch.
+QUERY_BUDGETS = {
+    "workspaces:choose": 8,         # 6
+    "workspaces:access": 10,        # 8
+    "accounts:approvals": 7,        # 5
+    "labels:design_home": 8,        # 6
+    "labels:generate_single": 18,   # 14 (POST)
+    "labels:generate_bulk": 20,     # 16 (POST)
+    "labels:history": 10,           # 8
+}
+QUERY_REPEAT_THRESHOLD = 5
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "False").lower() == "true"
+TEST_RUNNER = "core.test_runner.QueryBudgetTestRunner"
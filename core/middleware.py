@@ -0,0 +1,129 @@
+# core/middleware.py
+"""
+Attach the current workspace, its organization and the user's membership to
+the request (request.workspace, request.organization, request.membership,
+request.role).
+
+They are lazy, like request.user: the lookup (two queries) runs the first time
+a view or template reads one of them, once per request, so status polls,
+downloads and static files that never look pay nothing. Nothing is cached
+across requests, so a revoked membership takes effect on the next request.
+
+QueryBudgetMiddleware (below) counts each request's queries against a per-view budget.
+"""
+import logging, threading
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+from organizations.models import Membership
+from workspaces.models import Workspace
+from .queries import recording
+
+def _load(user, ws_id):
+    try:
+        workspace = Workspace.objects.select_related("organization").get(id=ws_id)
+    except Workspace.DoesNotExist:
+        return None, None
+    membership = Membership.objects.filter(
+        user=user, organization_id=workspace.organization_id, status=Membership.Status.ACTIVE
+    ).first()
+    return workspace, membership
+
+def resolve_context(request):
+    """(workspace, membership) for the session's current workspace; None for either if absent."""
+    ws_id = request.session.get("current_workspace_id")
+    if not ws_id or not request.user.is_authenticated:
+        return None, None
+    return _load(request.user, ws_id)
+
+class CurrentWorkspaceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        resolved = []
+
+        def context():
+            if not resolved:
+                resolved.append(resolve_context(request))
+            return resolved[0]
+
+        def organization():
+            workspace = context()[0]
+            return workspace.organization if workspace else None
+
+        def role():
+            membership = context()[1]
+            return membership.role if membership else None
+
+        request.workspace = SimpleLazyObject(lambda: context()[0])
+        request.organization = SimpleLazyObject(organization)
+        request.membership = SimpleLazyObject(lambda: context()[1])
+        request.role = SimpleLazyObject(role)
+        return self.get_response(request)
+
+# ---- query budgets ---------------------------------------------------------
+# Every request counts its SQL queries and DB time per view (URL name). A view
+# going over its budget (settings.QUERY_BUDGETS, else QUERY_BUDGET_DEFAULT), or
+# running the same statement QUERY_REPEAT_THRESHOLD+ times (the N+1 shape, e.g.
+# a template loop reaching through a foreign key), is logged; with
+# QUERY_BUDGET_STRICT (on under the test runner, core.test_runner) it raises instead, failing the test.
+# Counting, and the query_batch() blocks it honours, live in core.queries.
+
+query_logger = logging.getLogger("core.queries")
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+_view_stats_lock = threading.Lock()
+_view_stats = {}
+
+def view_query_stats():
+    """{view: {requests, queries, max_queries, db_ms}} for this process."""
+    with _view_stats_lock:
+        return {
+            view: {"requests": r, "queries": q, "max_queries": m, "db_ms": round(s * 1000, 3)}
+            for view, (r, q, m, s) in sorted(_view_stats.items())
+        }
+
+def _record_view(view, recorder):
+    with _view_stats_lock:
+        r, q, m, s = _view_stats.get(view, (0, 0, 0, 0.0))
+        _view_stats[view] = (r + 1, q + recorder.count, max(m, recorder.count), s + recorder.seconds)
+
+def query_budget(view):
+    budgets = getattr(settings, "QUERY_BUDGETS", {})
+    return budgets[view] if view in budgets else getattr(settings, "QUERY_BUDGET_DEFAULT", None)
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with recording() as recorder, ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else request.path
+        _record_view(view, recorder)
+        if settings.DEBUG:
+            timing = f"db;dur={recorder.seconds * 1000:.2f};desc=\"{recorder.count} queries\""
+            response["Server-Timing"] = ", ".join(filter(None, [response.get("Server-Timing"), timing]))
+
+        problems = []
+        budget = query_budget(view)
+        counted = recorder.budgeted_count()
+        if budget and counted > budget:
+            batches = f" in {recorder.batches} batches" if recorder.batches else ""
+            problems.append(f"{counted} queries{batches} (budget {budget})")
+        for sql, n in recorder.repeated(getattr(settings, "QUERY_REPEAT_THRESHOLD", 5)):
+            problems.append(f"{n}x {sql[:200]}")
+        if problems:
+            message = f"{request.method} {request.path} [{view}], {recorder.seconds * 1000:.1f} ms in DB: " + "; ".join(problems)
+            if getattr(settings, "QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(message)
+            query_logger.warning(message)
+        return response
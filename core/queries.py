@@ -0,0 +1,69 @@
+# core/queries.py
+"""
+SQL statement counting for the query budgets (core.middleware.QueryBudgetMiddleware).
+
+A QueryRecorder is installed as a connection.execute_wrapper for one request.
+Work repeated per batch by design (bulk generate saves each batch the same
+way) runs inside query_batch(): the budget then covers the statements outside
+batches plus the largest batch, and repeats are counted within each batch.
+Outside a recorded request, query_batch() does nothing, so code such as the
+bulk pipeline can mark its batches without depending on the middleware.
+"""
+import contextvars, time
+from collections import Counter
+from contextlib import contextmanager
+
+class QueryRecorder:
+    """connection.execute_wrapper hook counting statements and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.batch = 0          # current query_batch() number, 0 outside any
+        self.batches = 0
+        self.statements = Counter()     # (batch, sql) -> times run
+        self.per_batch = Counter()      # batch -> statements run
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.statements[(self.batch, sql)] += 1
+            self.per_batch[self.batch] += 1
+
+    def budgeted_count(self):
+        """Statements outside batches plus those of the largest batch."""
+        return self.per_batch[0] + max((n for b, n in self.per_batch.items() if b), default=0)
+
+    def repeated(self, threshold):
+        """[(sql, times)] for statements run at least `threshold` times within one batch (or outside them)."""
+        return [(sql, n) for (_batch, sql), n in self.statements.most_common() if n >= threshold]
+
+_recorder = contextvars.ContextVar("core_query_recorder", default=None)
+
+@contextmanager
+def recording():
+    """Make a new QueryRecorder the current one (for query_batch) inside the block; yields it."""
+    recorder = QueryRecorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+@contextmanager
+def query_batch():
+    """Count the block as one batch of per-batch work for the request's query budget."""
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    recorder.batches += 1
+    outer, recorder.batch = recorder.batch, recorder.batches
+    try:
+        yield
+    finally:
+        recorder.batch = outer
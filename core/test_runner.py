@@ -0,0 +1,17 @@
+# core/test_runner.py
+"""
+Test runner (settings.TEST_RUNNER) that enforces the query budgets: the whole
+run has QUERY_BUDGET_STRICT on, so a view over budget or an N+1 fails its test.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._strict = override_settings(QUERY_BUDGET_STRICT=True)
+        self._strict.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._strict.disable()
+        super().teardown_test_environment(**kwargs)
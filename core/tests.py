@@ -0,0 +1,164 @@
+import io
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from labels.models import LabelInstance, LabelTemplate
+from labels.tests import WorkspaceTestCase
+from organizations.models import Membership, Organization
+from workspaces.models import Workspace, WorkspaceAccess
+from .middleware import CurrentWorkspaceMiddleware, QueryBudgetExceeded, QueryBudgetMiddleware
+from .queries import query_batch
+
+User = get_user_model()
+
+class QueryBudgetViewTests(WorkspaceTestCase):
+    """
+    One request per budgeted view (settings.QUERY_BUDGETS) against data with
+    several rows behind every list, so an N+1 fails the test: the budgets are
+    enforced strictly under the test runner (core.test_runner).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        membership = Membership.objects.create(
+            user=cls.user, organization=cls.org, role=Membership.Role.ADMIN, status=Membership.Status.ACTIVE
+        )
+        cls.workspaces = [cls.ws] + [
+            Workspace.objects.create(organization=cls.org, name=f"WS {i}", slug=f"ws-{i}", created_by=cls.user)
+            for i in range(1, 6)
+        ]
+        for i in range(6):
+            user = User.objects.create_user(f"member{i}@acme.example", "pw")
+            member = Membership.objects.create(
+                user=user, organization=cls.org,
+                status=Membership.Status.ACTIVE if i % 2 else Membership.Status.PENDING,
+            )
+            for ws in cls.workspaces:
+                WorkspaceAccess.objects.create(membership=member, workspace=ws)
+        for ws in cls.workspaces:
+            WorkspaceAccess.objects.create(membership=membership, workspace=ws)
+
+        cls.templates = [cls.template] + [
+            LabelTemplate.objects.create(workspace=cls.ws, name=f"Shelf {i}", width_mm=30, height_mm=20, dpi=203,
+                                         created_by=cls.user, schema=cls.template.schema)
+            for i in range(1, 6)
+        ]
+        for i, tmpl in enumerate(cls.templates * 2):
+            LabelInstance.objects.create(workspace=cls.ws, template=tmpl, created_by=cls.user,
+                                         data={"name": f"Item {i}", "sku": f"SKU-{i}"})
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(LABELS_BULK_WORKERS=1, LABELS_RENDER_ASYNC=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.login()
+
+    def test_budgeted_views_are_covered(self):
+        covered = {"workspaces:choose", "workspaces:access", "accounts:approvals", "labels:design_home",
+                   "labels:generate_single", "labels:generate_bulk", "labels:history"}
+        self.assertEqual(set(settings.QUERY_BUDGETS), covered)
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+
+    def test_choose_workspace(self):
+        self.assertEqual(self.client.get(reverse("workspaces:choose")).status_code, 200)
+
+    def test_manage_access(self):
+        self.assertEqual(self.client.get(reverse("workspaces:access", args=[self.ws.id])).status_code, 200)
+
+    def test_approvals(self):
+        self.assertEqual(self.client.get(reverse("accounts:approvals")).status_code, 200)
+
+    def test_design_home(self):
+        self.assertEqual(self.client.get(reverse("labels:design_home")).status_code, 200)
+
+    def test_generate_single(self):
+        url = reverse("labels:generate_single", args=[self.template.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.post(url, {"name": "Tea", "sku": "T-1"}).status_code, 200)
+
+    def test_generate_bulk(self):
+        url = reverse("labels:generate_bulk", args=[self.template.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        # three batches of the default 200 rows: counted per batch, not as an N+1
+        rows = "".join(f"Item {i},SKU-{i}\n" for i in range(450))
+        upload = io.BytesIO(f"name,sku\n{rows}".encode())
+        upload.name = "rows.csv"
+        self.assertEqual(self.client.post(url, {"csv_file": upload}).status_code, 200)
+        self.assertEqual(LabelInstance.objects.filter(workspace=self.ws).count(), 12 + 450)
+
+    def test_history(self):
+        self.assertEqual(self.client.get(reverse("labels:history")).status_code, 200)
+        self.assertEqual(self.client.get(reverse("labels:history"), {"q": "item"}).status_code, 200)
+
+@override_settings(QUERY_BUDGET_STRICT=True, QUERY_REPEAT_THRESHOLD=3)
+class QueryBudgetMiddlewareTests(TestCase):
+    def run_view(self, view, budget=10):
+        request = RequestFactory().get("/")
+        with override_settings(QUERY_BUDGETS={"/": budget}):
+            return QueryBudgetMiddleware(lambda request: view() or "ok")(request)
+
+    def query(self, n=1):
+        with connection.cursor() as cursor:
+            for i in range(n):
+                cursor.execute("SELECT %s", [i])
+
+    def test_within_budget(self):
+        self.assertEqual(self.run_view(lambda: self.query(2)), "ok")
+
+    def test_over_budget_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "(budget 1)"):
+            self.run_view(lambda: [self.query(), User.objects.count()], budget=1)
+
+    def test_repeated_statement_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "3x SELECT"):
+            self.run_view(lambda: self.query(3))
+
+    def test_batches_count_once_for_the_budget_and_repeats(self):
+        def batched():
+            for _ in range(4):
+                with query_batch():
+                    self.query(2)
+        self.assertEqual(self.run_view(batched, budget=2), "ok")
+
+class CurrentWorkspaceMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("someone@acme.example", "pw")
+        org = Organization.objects.create(name="Acme", domain="acme.example")
+        cls.membership = Membership.objects.create(
+            user=cls.user, organization=org, role=Membership.Role.ADMIN, status=Membership.Status.ACTIVE
+        )
+        cls.ws = Workspace.objects.create(organization=org, name="Main", slug="main")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.session = self.client.session
+        self.session["current_workspace_id"] = self.ws.id
+        self.session.save()
+
+    def request(self):
+        request = RequestFactory().get("/")
+        request.user, request.session = self.user, self.session
+        CurrentWorkspaceMiddleware(lambda request: None)(request)
+        return request
+
+    def test_context_is_resolved_only_when_read(self):
+        with self.assertNumQueries(0):
+            request = self.request()
+        with self.assertNumQueries(2):
+            self.assertEqual(request.workspace, self.ws)
+            self.assertEqual(request.organization, self.ws.organization)
+            self.assertEqual(request.membership, self.membership)
+            self.assertEqual(request.role, Membership.Role.ADMIN)
+
+    def test_revoked_membership_shows_on_the_next_request(self):
+        self.assertEqual(self.request().role, Membership.Role.ADMIN)
+        Membership.objects.filter(id=self.membership.id).update(status=Membership.Status.PENDING)
+        request = self.request()
+        self.assertEqual(request.workspace, self.ws)
+        self.assertFalse(request.membership)
+        self.assertFalse(request.role)
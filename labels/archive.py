@@ -0,0 +1,83 @@
+"""
+Streaming ZIP archives of generated label files.
+
+zipfile writes to a non-seekable sink here (sizes go in data descriptors), and
+the generator hands back whatever the sink holds after every chunk, so the
+response stays at one read buffer of memory however many labels it carries.
+PNGs are already deflated, so entries are stored rather than compressed again.
+"""
+import csv, io, json, os, tempfile, time, zipfile
+from django.conf import settings
+from django.utils.text import slugify
+
+READ_CHUNK = 256 * 1024
+MANIFEST_SPOOL = 1024 * 1024   # manifest rows beyond this go to a temp file until the end
+
+class _Sink(io.RawIOBase):
+    """Write-only, non-seekable buffer the ZipFile writes into; drained by the generator."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buf += data
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos   # zipfile asks for offsets, never seeks
+
+    def drain(self):
+        data = bytes(self.buf)
+        self.buf.clear()
+        return data
+
+def archive_name(inst):
+    ext = os.path.splitext(inst.png_path)[1] or ".png"
+    return f"{slugify(inst.template.name) or 'template'}/{inst.serial_no or inst.id}{ext}"
+
+def iter_label_zip(instances, manifest=True):
+    """
+    Yield the bytes of a ZIP holding the file of each instance (template/serial.png),
+    plus a manifest.csv of serial, template, created_at, file and data.
+    Instances whose file is missing are listed in the manifest with an empty file.
+    """
+    sink = _Sink()
+    with tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL, mode="w+", encoding="utf-8", newline="") as rows, \
+            zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        writer = csv.writer(rows)
+        writer.writerow(["serial_no", "template", "created_at", "file", "data"])
+        for inst in instances:
+            name = archive_name(inst)
+            try:
+                src = open(os.path.join(settings.MEDIA_ROOT, inst.png_path), "rb") if inst.png_path else None
+            except OSError:
+                src = None
+            if src is None:
+                name = ""
+            else:
+                with src:
+                    info = zipfile.ZipInfo(name, date_time=inst.created_at.timetuple()[:6])
+                    info.file_size = os.fstat(src.fileno()).st_size
+                    with zf.open(info, "w") as dst:
+                        while chunk := src.read(READ_CHUNK):
+                            dst.write(chunk)
+                            if sink.buf:
+                                yield sink.drain()
+                yield sink.drain()   # the data descriptor
+            writer.writerow([inst.serial_no or "", inst.template.name, inst.created_at.isoformat(),
+                             name, json.dumps(inst.data, ensure_ascii=False)])
+        if manifest:
+            rows.seek(0)
+            info = zipfile.ZipInfo("manifest.csv", date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with zf.open(info, "w") as dst:
+                while chunk := rows.read(READ_CHUNK):
+                    dst.write(chunk.encode("utf-8"))
+                    if sink.buf:
+                        yield sink.drain()
+    yield sink.drain()   # central directory
@@ -0,0 +1,323 @@
+"""
+Render benchmarks (driven by `manage.py bench_render`).
+
+Cases cover the premade layouts from seed_premade_templates plus synthetic
+heavy templates, each at several printer resolutions, the barcode/QR painters
+with cold and warm caches, and file encoding per output profile; renders run in
+colour and in the monochrome "L"/"1" modes. Templates are unsaved model
+instances (nothing touches the database) and image elements are served by a
+local HTTP server into a throwaway image cache, so runs are repeatable offline.
+
+Results are written in pytest-benchmark's JSON layout, so the files can also be
+compared with `pytest-benchmark compare`.
+"""
+import datetime, io, json, os, platform, statistics, subprocess, sys, tempfile, threading, time, zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.test.utils import override_settings
+from PIL import Image, ImageDraw
+from . import images, utils
+from .models import LabelTemplate
+from .output import PROFILES
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+DPIS = (203, 300, 600)
+DESIGN_DPI = 300    # the premade schemas are laid out in 300 dpi pixels
+
+@dataclass
+class Case:
+    group: str
+    name: str
+    func: object            # func(i) runs one round; i is the round number
+    params: dict = field(default_factory=dict)
+
+@dataclass
+class CaseResult:
+    case: Case
+    times: list             # seconds per round
+    rss_delta_kb: int       # how far the case raised the process's peak RSS (0: stayed under earlier cases)
+
+    def percentile(self, p):
+        data = sorted(self.times)
+        k = (len(data) - 1) * p / 100
+        lo, hi = int(k), min(int(k) + 1, len(data) - 1)
+        return data[lo] + (data[hi] - data[lo]) * (k - lo)
+
+    @property
+    def per_sec(self):
+        total = sum(self.times)
+        return len(self.times) / total if total else 0.0
+
+# ---- fixtures --------------------------------------------------------------
+
+def _png(seed, size=(400, 400)):
+    img = Image.new("RGB", size, (seed * 37 % 256, seed * 91 % 256, seed * 53 % 256))
+    draw = ImageDraw.Draw(img)
+    for k in range(0, size[0], 16):
+        draw.line([(k, 0), (size[0] - k, size[1])], fill=(255 - k % 256, k % 256, 128), width=3)
+    out = io.BytesIO()
+    img.save(out, "PNG")
+    return out.getvalue()
+
+class _ImageServer:
+    """Serves /img/<n>.png from memory on 127.0.0.1 for image elements."""
+
+    def __init__(self, count=16):
+        bodies = {f"/img/{n}.png": _png(n) for n in range(count)}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = bodies.get(self.path)
+                self.send_response(200 if body else 404)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                self.wfile.write(body or b"")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, n):
+        return f"http://127.0.0.1:{self.server.server_port}/img/{n}.png"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+def premade_layouts():
+    from .management.commands.seed_premade_templates import PREMADE, default_schema_for
+    return [(p["name"].split(":")[0].lower().replace(" ", ""), p["size"], default_schema_for(p["name"]))
+            for p in PREMADE]
+
+def synthetic_layouts():
+    """Heavier than anything premade: many texts, many codes, many images."""
+    text_heavy = [
+        {"type": "text", "x": 8 + (i % 2) * 300, "y": 8 + (i // 2) * 28, "w": 280, "h": 24,
+         "fontSize": 10 + i % 8, "dataKey": f"t{i}"}
+        for i in range(40)
+    ]
+    codes_heavy = (
+        [{"type": "barcode", "x": 8 + (i % 3) * 300, "y": 8 + (i // 3) * 140, "w": 280, "h": 120,
+          "dataKey": f"b{i}"} for i in range(6)]
+        + [{"type": "qrcode", "x": 920 + (i % 2) * 140, "y": 8 + (i // 2) * 140, "w": 130, "h": 130,
+            "dataKey": f"q{i}"} for i in range(6)]
+    )
+    image_heavy = [
+        {"type": "image", "x": 8 + (i % 4) * 200, "y": 8 + (i // 4) * 200, "w": 190, "h": 190,
+         "dataKey": f"img{i}"}
+        for i in range(8)
+    ] + [{"type": "text", "x": 8, "y": 420, "w": 400, "h": 30, "fontSize": 24, "dataKey": "product_name"}]
+    return [
+        ("text_heavy", (100.0, 150.0), {"elements": text_heavy}),
+        ("codes_heavy", (100.0, 40.0), {"elements": codes_heavy}),
+        ("image_heavy", (70.0, 40.0), {"elements": image_heavy}),
+    ]
+
+def scaled_schema(schema, dpi):
+    """Scale a DESIGN_DPI pixel layout to `dpi` so the label keeps its physical size."""
+    f = dpi / DESIGN_DPI
+    out = []
+    for el in schema.get("elements", []):
+        el = dict(el)
+        for k in ("x", "y", "w", "h", "fontSize"):
+            if k in el:
+                el[k] = max(1, round(el[k] * f))
+        out.append(el)
+    return {"elements": out}
+
+def _template(pk, name, size, schema, dpi):
+    # unsaved, but with a pk so plan and base-layer caching behave as they do for real templates
+    return LabelTemplate(
+        pk=pk, name=name, width_mm=size[0], height_mm=size[1], dpi=dpi,
+        schema=scaled_schema(schema, dpi), updated_at=datetime.datetime(2000, 1, 1),
+    )
+
+def _payload(tag, i, schema, server):
+    # code values are unique per case and round, so every render encodes its codes cold
+    data = {"product_name": f"Bench product {i}", "sku": f"{tag}-{i:06d}", "code_value": f"{tag}-{i:06d}",
+            "category": "Category", "product_type": "Type", "company_name": "ACME Ltd",
+            "company_address": "1 Benchmark Road, Testville", "contact_details": "+00 000 0000"}
+    for el in schema["elements"]:
+        key = el.get("dataKey")
+        if el["type"] == "image":
+            data[key] = server.url(zlib.crc32(key.encode()) % 4)   # a few shared images, like logos/product shots
+        elif el["type"] in ("barcode", "qrcode"):
+            data[key] = f"{tag}-{key.upper()}-{i:06d}"
+        elif key not in data:
+            data[key] = f"{key} value {i}"
+    return data
+
+# ---- cases -----------------------------------------------------------------
+
+def build_cases(server, dpis=DPIS):
+    cases = []
+    layouts = [("premade", *l) for l in premade_layouts()] + [("synthetic", *l) for l in synthetic_layouts()]
+    pk = -1
+    for group, name, size, schema in layouts:
+        for dpi in dpis:
+            tmpl = _template(pk, name, size, schema, dpi)
+            pk -= 1
+
+            def run(i, tmpl=tmpl, schema=tmpl.schema, tag=f"R{-pk}"):
+                utils.render_label_to_image(tmpl, _payload(tag, i, schema, server))
+
+            def run_png(i, tmpl=tmpl, schema=tmpl.schema, tag=f"P{-pk}"):
+                utils.render_label_to_image(tmpl, _payload(tag, i, schema, server)).save(io.BytesIO(), "PNG")
+
+            params = {"layout": name, "dpi": dpi, "elements": len(schema["elements"]),
+                      "images": sum(el["type"] == "image" for el in schema["elements"])}
+            cases.append(Case(f"render:{group}", f"render[{name}-{dpi}dpi]", run, params))
+            cases.append(Case(f"render+png:{group}", f"render_png[{name}-{dpi}dpi]", run_png, params))
+            for mode in ("L", "1"):
+                def run_mono(i, tmpl=tmpl, schema=tmpl.schema, tag=f"M{mode}{-pk}", mode=mode):
+                    utils.render_label_to_image(tmpl, _payload(tag, i, schema, server), mode=mode)
+
+                cases.append(Case(f"render-{mode}:{group}", f"render[{name}-{dpi}dpi-{mode}]", run_mono,
+                                  dict(params, mode=mode)))
+
+    # file encoding per output profile, on one finished label per resolution
+    name, size, schema = premade_layouts()[0]
+    for dpi in dpis:
+        img = utils.render_label_to_image(_template(pk, name, size, schema, dpi), _payload("E", 0, schema, server))
+        pk -= 1
+        for profile in PROFILES.values():
+            cases.append(Case("encode", f"encode[{profile.key}-{dpi}dpi]", lambda i, p=profile, im=img: p.encode(im),
+                              {"profile": profile.key, "dpi": dpi, "bytes": len(profile.encode(img))}))
+
+    for dpi in dpis:
+        f = dpi / DESIGN_DPI
+        bar = (round(280 * f), round(120 * f))
+        qr = (round(130 * f), round(130 * f))
+        # cold: a new value every round (encode + paint); warm: the memoized bitmap
+        cases += [
+            Case("codes", f"draw_barcode_cold[{dpi}dpi]", lambda i, s=bar, d=dpi: utils._draw_barcode(f"COLD-{d}-{i:07d}", s),
+                 {"dpi": dpi, "size": bar}),
+            Case("codes", f"draw_barcode_warm[{dpi}dpi]", lambda i, s=bar: utils._draw_barcode("WARM-0000001", s),
+                 {"dpi": dpi, "size": bar}),
+            Case("codes", f"draw_qr_cold[{dpi}dpi]", lambda i, s=qr, d=dpi: utils._draw_qr(f"https://ex.am/p/{d}/{i:07d}", s),
+                 {"dpi": dpi, "size": qr}),
+            Case("codes", f"draw_qr_warm[{dpi}dpi]", lambda i, s=qr: utils._draw_qr("https://ex.am/p/warm", s),
+                 {"dpi": dpi, "size": qr}),
+        ]
+    return cases
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss   # bytes on macOS, KiB on Linux
+
+def run_case(case, rounds, warmup):
+    # ru_maxrss is a process-wide high-water mark, so only its growth across the
+    # case (warmup included) can be put down to the case.
+    rss_before = peak_rss_kb()
+    for i in range(warmup):
+        case.func(-1 - i)
+    times = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        case.func(i)
+        times.append(time.perf_counter() - start)
+    rss_after = peak_rss_kb()
+    return CaseResult(case, times, None if rss_before is None else rss_after - rss_before)
+
+def run(rounds=100, warmup=5, dpis=DPIS, select=None, progress=None):
+    """Run every case whose name contains `select`; returns [CaseResult]."""
+    results = []
+    with tempfile.TemporaryDirectory() as cache, override_settings(LABELS_IMAGE_CACHE_DIR=cache), \
+            _ImageServer() as server:
+        for lru in (images._decoded, images._resized, images._index):
+            lru.clear()
+        for case in build_cases(server, dpis):
+            if select and select not in case.name:
+                continue
+            result = run_case(case, rounds, warmup)
+            results.append(result)
+            if progress:
+                progress(result)
+    return results
+
+# ---- pytest-benchmark JSON -------------------------------------------------
+
+def _stats(times):
+    data = sorted(times)
+    n = len(data)
+    mean = statistics.fmean(data)
+    stddev = statistics.stdev(data) if n > 1 else 0.0
+    q1, _median, q3 = statistics.quantiles(data, n=4) if n > 1 else (data[0],) * 3
+    iqr = q3 - q1
+    lo_fence, hi_fence = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    inside = [t for t in data if lo_fence <= t <= hi_fence] or data
+    return {
+        "min": data[0], "max": data[-1], "mean": mean, "stddev": stddev, "rounds": n,
+        "median": statistics.median(data), "iqr": iqr, "q1": q1, "q3": q3,
+        "iqr_outliers": n - len(inside),
+        "stddev_outliers": sum(abs(t - mean) > stddev for t in data),
+        "outliers": f"{sum(abs(t - mean) > stddev for t in data)};{n - len(inside)}",
+        "ld15iqr": inside[0], "hd15iqr": inside[-1],
+        "ops": n / sum(data) if sum(data) else 0.0, "total": sum(data), "iterations": 1,
+    }
+
+def _commit_info():
+    try:
+        sha = subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True,
+                             text=True, timeout=5).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, timeout=5).stdout.strip())
+    except (OSError, subprocess.SubprocessError):
+        sha, dirty = "", False
+    return {"id": sha or None, "dirty": dirty}
+
+def to_json(results):
+    return {
+        "machine_info": {
+            "node": platform.node(), "processor": platform.processor(), "machine": platform.machine(),
+            "python_implementation": platform.python_implementation(), "python_version": platform.python_version(),
+            "system": platform.system(), "release": platform.release(), "cpu": {"count": os.cpu_count()},
+        },
+        "commit_info": _commit_info(),
+        "benchmarks": [
+            {
+                "group": r.case.group, "name": r.case.name, "fullname": f"labels.bench::{r.case.name}",
+                "params": r.case.params, "param": r.case.name.partition("[")[2].rstrip("]") or None,
+                "stats": _stats(r.times),
+                "extra_info": {
+                    "labels_per_sec": r.per_sec, "p50": r.percentile(50), "p99": r.percentile(99),
+                    "rss_delta_kb": r.rss_delta_kb,
+                },
+                "options": {"timer": "perf_counter", "min_rounds": len(r.times), "warmup": True},
+            }
+            for r in results
+        ],
+        "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "version": "labels-bench-1",
+    }
+
+def compare(results, baseline, threshold=0.10):
+    """[(name, baseline median, current median, relative change)] for cases slower than threshold."""
+    before = {b["name"]: b["stats"]["median"] for b in baseline.get("benchmarks", [])}
+    slower = []
+    for r in results:
+        old = before.get(r.case.name)
+        if old:
+            new = statistics.median(r.times)
+            change = (new - old) / old
+            if change > threshold:
+                slower.append((r.case.name, old, new, change))
+    return slower
+
+def load_json(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
@@ -0,0 +1,250 @@
+"""
+Bulk label generation (CSV uploads and queued render jobs).
+
+Rows are streamed in batches, each batch is rendered across a
+process pool, and the resulting LabelInstance rows are inserted per batch.
+A row that fails to render is reported back; it never aborts the job.
+"""
+import csv, io, os, pickle
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from django.conf import settings
+from django.db import transaction
+from core.queries import query_batch
+from .images import prefetch, image_urls
+from .pdf import impose_instances
+from .plans import get_render_plan
+from .services import (
+    template_field_defs, collect_schema_code_fields, build_payload,
+    render_hash, existing_rendered_files, create_label_instances, remove_label_files,
+)
+from .utils import render_label_to_image
+from . import timing
+from .timing import span
+from .output import get_profile
+
+DEFAULT_BATCH_SIZE = 200
+
+@dataclass
+class RowError:
+    row: int        # line number in the CSV (header is line 1)
+    error: str
+
+@dataclass
+class BulkResult:
+    created: int = 0
+    errors: list = field(default_factory=list)
+    instance_ids: list = field(default_factory=list)
+    pdf_path: str = ""      # print sheet, when a SheetLayout was requested
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+# ---- worker side -----------------------------------------------------------
+
+_worker_template = None
+_worker_profile = None
+
+def _init_worker(pickled_template, profile_key=None):
+    global _worker_template, _worker_profile
+    # spawn/forkserver children start without Django configured, so the
+    # template is unpickled only once the app registry is ready
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _worker_template = pickle.loads(pickled_template)
+    _worker_profile = get_profile(profile_key, _worker_template)
+
+def _render_one(template, profile, job):
+    """Render one (row, payload, static_keys) job to file bytes; errors are returned, not raised."""
+    row, payload, static_keys = job
+    try:
+        img = render_label_to_image(template, payload, static_keys, profile.render_mode)
+        with span("encode"):
+            return row, payload, profile.encode(img), None
+    except Exception as e:
+        return row, payload, None, str(e) or e.__class__.__name__
+
+def _render_row(job):
+    """_render_one in a pool child, plus the child's span samples for the parent to replay."""
+    # the globals are set by the pool initializer, never in the parent, where
+    # concurrent requests (threaded servers) would share them
+    if not timing.enabled():
+        return (*_render_one(_worker_template, _worker_profile, job), None)
+    with timing.capture() as samples:
+        outcome = _render_one(_worker_template, _worker_profile, job)
+    return (*outcome, samples)
+
+# ---- main side -------------------------------------------------------------
+
+def default_worker_count():
+    return getattr(settings, "LABELS_BULK_WORKERS", None) or os.cpu_count() or 1
+
+def _text_stream(fileobj):
+    # Django uploads are binary; management commands may hand us text
+    if isinstance(fileobj.read(0), bytes):
+        return io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    return fileobj
+
+def _constant_keys(payloads):
+    """Keys holding the same value in every payload (logo, company...), for the renderer's base layer."""
+    if len(payloads) < 2:
+        return frozenset()
+    first = payloads[0]
+    return frozenset(k for k, v in first.items() if all(p.get(k) == v for p in payloads[1:]))
+
+def _iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield _with_static_keys(batch)
+            batch = []
+    if batch:
+        yield _with_static_keys(batch)
+
+def _with_static_keys(batch):
+    static_keys = _constant_keys([payload for _row, payload in batch])
+    return [(row, payload, static_keys) for row, payload in batch]
+
+def instances_in_order(ids, chunk=500):
+    from .models import LabelInstance
+    for start in range(0, len(ids), chunk):
+        yield from (
+            LabelInstance.objects.filter(id__in=ids[start:start + chunk])
+            .select_related("template").order_by("serial_no", "id")
+        )
+
+def read_csv_rows(template, fileobj):
+    """
+    Yield (CSV line number, payload) for each non-empty row of `fileobj`.
+
+    Raises ValueError right away when the header shares no column with the template.
+    """
+    field_defs = template_field_defs(template)
+    code_fields = collect_schema_code_fields(template)
+    expected = {f["key"] for f in field_defs} | {cf["key"] for cf in code_fields} | {"code_value"}
+
+    reader = csv.DictReader(_text_stream(fileobj))
+    header = [h.strip() for h in (reader.fieldnames or [])]
+    if not expected.intersection(header):
+        raise ValueError("CSV header does not match this template. Download the CSV format first.")
+    reader.fieldnames = header
+
+    def rows():
+        for row in reader:
+            if not any((v or "").strip() for v in row.values() if isinstance(v, str)):
+                continue  # trailing ",,,," lines from spreadsheets
+            yield reader.line_num, build_payload(row, field_defs, code_fields)
+    return rows()
+
+def generate_labels(template, workspace, user, rows, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                    sheet_layout=None, progress=None, output=None):
+    """
+    Render and save one label per (row number, payload) in `rows`, encoded with
+    the `output` profile (labels.output; default: the template's).
+
+    With a SheetLayout, the labels created are also imposed onto a print-sheet PDF
+    (BulkResult.pdf_path). `progress(rows_processed, result)` is called for each
+    batch inside the transaction that saves it; an exception from it rolls the
+    batch back and propagates. Raises ValueError when the layout can't fit the
+    label; every other problem is collected per row in BulkResult.errors.
+    """
+    if sheet_layout is not None:
+        sheet_layout.grid(template.width_mm, template.height_mm)  # fail before rendering anything
+
+    workers = max(1, int(workers or default_worker_count()))
+    result = BulkResult()
+    pool = None
+    profile = get_profile(output, template)
+    pickled = pickle.dumps(template)
+    processed = 0
+
+    try:
+        plan = get_render_plan(template)
+        for batch in _iter_batches(rows, batch_size):
+            with query_batch():   # the same statements run for every batch
+                processed += len(batch)
+                # fetch every distinct image URL of the batch concurrently up front; the
+                # workers then read them from the shared disk cache instead of the network
+                payloads = [payload for _row, payload, _static in batch]
+                prefetch(image_urls(plan, payloads))
+
+                # render each new (template version, data) once: reprints of earlier
+                # labels and duplicates within the batch reuse that one file
+                digests = [render_hash(template, p, profile) for p in payloads]
+                existing = existing_rendered_files(workspace, digests)
+                jobs, seen, digest_of = [], set(existing), {}
+                for job, digest in zip(batch, digests):
+                    digest_of[job[0]] = digest
+                    if digest not in seen:
+                        seen.add(digest)
+                        jobs.append(job)
+
+                if workers > 1 and len(jobs) > 1:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pickled, profile.key))
+                    chunk = max(1, len(jobs) // (workers * 4))
+                    outcomes = list(pool.map(_render_row, jobs, chunksize=chunk))
+                else:
+                    outcomes = [(*_render_one(template, profile, job), None) for job in jobs]   # too small for the pool
+
+                pngs, failures = {}, {}
+                for row, _payload, png, error, samples in outcomes:
+                    if samples:
+                        timing.replay(samples)
+                    if error:
+                        failures[digest_of[row]] = error
+                    else:
+                        pngs[digest_of[row]] = png
+
+                rendered = []
+                for (row, payload, _static), digest in zip(batch, digests):
+                    if digest in failures:
+                        result.errors.append(RowError(row, failures[digest]))
+                    else:
+                        rendered.append((row, payload, digest, pngs.get(digest), existing.get(digest)))
+                saved = []
+                try:
+                    with transaction.atomic():
+                        if rendered:
+                            try:
+                                saved = create_label_instances(
+                                    template, workspace, user, [r[1:] for r in rendered], profile
+                                )
+                            except Exception as e:
+                                result.errors.extend(RowError(r[0], f"Could not save: {e}") for r in rendered)
+                            else:
+                                result.created += len(saved)
+                                result.instance_ids.extend(inst.id for inst in saved)
+                        if progress:
+                            progress(processed, result)
+                except BaseException:
+                    remove_label_files(saved)   # the batch rolled back after its files were written
+                    raise
+    finally:
+        if pool:
+            pool.shutdown()
+
+    if sheet_layout is not None and result.instance_ids:
+        result.pdf_path, _pages, _placed = impose_instances(
+            workspace, instances_in_order(result.instance_ids), sheet_layout
+        )
+    return result
+
+def generate_from_csv(template, workspace, user, fileobj, workers=None, batch_size=DEFAULT_BATCH_SIZE,
+                      sheet_layout=None, output=None):
+    """
+    Render one label per CSV row for `template` inside `workspace`.
+
+    Raises ValueError when the CSV header shares no column with the template, or
+    the layout can't fit the label; see generate_labels() for the rest.
+    """
+    if sheet_layout is not None:
+        sheet_layout.grid(template.width_mm, template.height_mm)
+    return generate_labels(
+        template, workspace, user, read_csv_rows(template, fileobj),
+        workers=workers, batch_size=batch_size, sheet_layout=sheet_layout, output=output,
+    )
@@ -0,0 +1,73 @@
+"""
+Small in-process LRU used by the renderer caches (plans, base layers, images).
+
+Bounded by entry count, by approximate bytes, or both; thread-safe, with
+hit/miss counters so the caches can be inspected from a shell or an endpoint.
+"""
+import threading
+from collections import OrderedDict
+
+def image_nbytes(img):
+    """Approximate in-memory size of a PIL image without copying its pixels."""
+    return img.width * img.height * len(img.getbands())
+
+class LRUCache:
+    def __init__(self, max_items=None, max_bytes=None, sizeof=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        nbytes = self.sizeof(value)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return  # would evict everything else; not worth keeping
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._data and (
+                (self.max_items is not None and len(self._data) > self.max_items)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _key, (_value, size) = self._data.popitem(last=False)
+                self._bytes -= size
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self):
+        return {
+            "items": len(self._data), "bytes": self._bytes,
+            "hits": self.hits, "misses": self.misses,
+            "max_items": self.max_items, "max_bytes": self.max_bytes,
+        }
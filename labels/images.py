@@ -0,0 +1,215 @@
+"""
+Remote image cache for image elements.
+
+Most labels in a run share a handful of image URLs (the logo, a few product
+shots), so fetching is layered:
+
+  * an in-memory URL index answers fresh URLs without touching the network;
+  * stale entries are revalidated with If-None-Match / If-Modified-Since over
+    a pooled requests.Session, so a 304 costs one round-trip and no body;
+  * bodies are stored content-addressed (sha256) on disk under MEDIA_ROOT and
+    survive restarts and are shared between worker processes;
+  * decoded RGBA images and their resized variants live in byte-bounded LRUs;
+  * prefetch() warms all of that for a whole batch from a thread pool, so
+    network latency overlaps instead of adding up label after label.
+
+Returned images are shared between callers and must not be modified in place.
+"""
+import hashlib, io, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from django.conf import settings
+from .cache import LRUCache, image_nbytes
+
+FETCH_TIMEOUT = 5          # seconds, per request
+FRESH_SECONDS = 300        # serve from cache without revalidating for this long
+FAILURE_SECONDS = 60       # don't retry a failing URL (with no cached copy) for this long
+POOL_SIZE = 16
+PREFETCH_WORKERS = 8
+
+_decoded = LRUCache(max_items=256, max_bytes=128 * 1024 * 1024, sizeof=image_nbytes)   # sha -> RGBA
+_resized = LRUCache(max_items=2048, max_bytes=128 * 1024 * 1024, sizeof=image_nbytes)  # (sha, w, h) -> RGBA
+_index = LRUCache(max_items=4096)      # url -> meta dict (sha, etag, last_modified, checked_at | failed_at)
+
+_session_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+class ImageFetchError(Exception):
+    pass
+
+def cache_dir():
+    return getattr(settings, "LABELS_IMAGE_CACHE_DIR", None) or os.path.join(settings.MEDIA_ROOT, "cache", "images")
+
+def get_session():
+    """One pooled Session per process (a forked bulk worker must not reuse the parent's sockets)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session, _session_pid = s, pid
+    return _session
+
+# ---- disk tier -------------------------------------------------------------
+
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _blob_path(sha):
+    return os.path.join(cache_dir(), "blobs", sha[:2], sha)
+
+def _meta_path(url):
+    h = _sha(url.encode("utf-8"))
+    return os.path.join(cache_dir(), "urls", h[:2], f"{h}.json")
+
+def atomic_write(path, data):
+    """Write via a temp file and rename: readers never see a partial file, and a
+    path that is a hard link gets a new inode instead of truncating the shared one."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+
+def _load_meta(url):
+    meta = _index.get(url)
+    if meta is not None:
+        return meta
+    try:
+        with open(_meta_path(url), "r", encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    _index.set(url, meta)
+    return meta
+
+def _store_meta(url, meta):
+    _index.set(url, meta)
+    try:
+        atomic_write(_meta_path(url), json.dumps(meta).encode("utf-8"))
+    except OSError:
+        pass  # the disk tier is best effort; memory still has it
+
+# ---- fetching --------------------------------------------------------------
+
+def _state(url, now):
+    """(meta, have_blob, fresh) for url; fresh means no network needed right now."""
+    meta = _load_meta(url)
+    have_blob = bool(meta and meta.get("sha")) and os.path.exists(_blob_path(meta["sha"]))
+    if have_blob:
+        fresh = now - meta.get("checked_at", 0) < FRESH_SECONDS
+    else:
+        fresh = bool(meta) and now - meta.get("failed_at", 0) < FAILURE_SECONDS
+    return meta, have_blob, fresh
+
+def fetch(url):
+    """Return the sha256 of the current body of `url`, fetching or revalidating as needed."""
+    now = time.time()
+    meta, have_blob, fresh = _state(url, now)
+    if fresh:
+        if have_blob:
+            return meta["sha"]
+        # a recent failure is recorded on disk too, so bulk workers skip it as well
+        raise ImageFetchError(f"recently failed: {meta.get('error') or url}")
+
+    headers = {}
+    if have_blob:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        r = get_session().get(url, timeout=FETCH_TIMEOUT, headers=headers)
+        if r.status_code == 304 and have_blob:
+            _store_meta(url, dict(meta, checked_at=now))
+            return meta["sha"]
+        r.raise_for_status()
+        body = r.content
+    except Exception as e:
+        if have_blob:
+            return meta["sha"]  # serve stale rather than a placeholder
+        _store_meta(url, {"failed_at": now, "error": str(e)[:200]})
+        raise ImageFetchError(str(e)) from e
+
+    sha = _sha(body)
+    path = _blob_path(sha)
+    if not os.path.exists(path):
+        try:
+            atomic_write(path, body)
+        except OSError:
+            pass
+    if not os.path.exists(path):
+        # unwritable cache dir: keep the decoded copy in memory at least
+        _decoded.set(sha, Image.open(io.BytesIO(body)).convert("RGBA"))
+    _store_meta(url, {
+        "sha": sha,
+        "etag": r.headers.get("ETag", ""),
+        "last_modified": r.headers.get("Last-Modified", ""),
+        "checked_at": now,
+    })
+    return sha
+
+def _decode(sha):
+    img = _decoded.get(sha)
+    if img is None:
+        with open(_blob_path(sha), "rb") as fh:
+            img = Image.open(io.BytesIO(fh.read())).convert("RGBA")
+        _decoded.set(sha, img)
+    return img
+
+def load_image(url, target_size=None):
+    """Return the RGBA image at `url`, resized to target_size if given. Raises on failure."""
+    try:
+        sha = fetch(url)
+        if not target_size:
+            return _decode(sha)
+        key = (sha, int(target_size[0]), int(target_size[1]))
+        return _resized.get_or_set(key, lambda: _decode(sha).resize(key[1:], Image.LANCZOS))
+    except ImageFetchError:
+        raise
+    except Exception as e:
+        raise ImageFetchError(str(e)) from e
+
+def prefetch(urls, max_workers=None):
+    """
+    Fetch many URLs concurrently into the cache (deduplicated, fresh ones skipped).
+
+    Returns {url: sha256 or None}. Later load_image() calls for these URLs,
+    in this process or in a bulk worker reading the disk tier, need no network.
+    """
+    now = time.time()
+    todo = [u for u in dict.fromkeys(u for u in urls if u) if not _state(u, now)[2]]
+    if not todo:
+        return {}
+
+    def one(url):
+        try:
+            return url, fetch(url)
+        except ImageFetchError:
+            return url, None
+
+    workers = max_workers or getattr(settings, "LABELS_IMAGE_PREFETCH_WORKERS", None) or PREFETCH_WORKERS
+    workers = min(len(todo), workers)
+    if workers == 1:
+        return dict(map(one, todo))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(one, todo))
+
+def image_urls(plan, payloads):
+    """Every URL the plan's image elements will load for these payloads."""
+    keys = [op.key for op in plan.ops if op.kind == "image" and op.key]
+    return [p.get(k) for p in payloads for k in keys if p.get(k)]
+
+def stats():
+    return {
+        "decoded": _decoded.stats(),
+        "resized": _resized.stats(),
+        "index": _index.stats(),
+    }
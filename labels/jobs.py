@@ -0,0 +1,165 @@
+"""
+Queued rendering: the web request stores a RenderJob and returns at once; a
+`manage.py run_render_workers` process claims jobs from the database and
+renders them with the bulk pipeline (process pool, dedup, batch inserts).
+
+The database is the queue, so no broker is needed. On backends with
+SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL, MySQL 8) concurrent workers
+skip rows another worker holds; elsewhere (SQLite) a job is claimed with a
+conditional UPDATE on its status, which only one worker can win.
+
+Progress is saved in the same transaction as each batch's labels, and only
+while the worker still holds its claim, so a worker that lost its job (requeued
+after a missed heartbeat) rolls its batch back instead of duplicating labels.
+A background thread heartbeats while the job runs, slow batches and sheet
+imposition included. A job whose worker stops heartbeating is put back in the
+queue and resumes after the last saved batch.
+"""
+import os, socket, threading
+from dataclasses import asdict
+from datetime import timedelta
+from django.db import connection, transaction, DatabaseError
+from django.db.models import F
+from django.utils import timezone
+from .bulk import generate_labels, instances_in_order, DEFAULT_BATCH_SIZE
+from .pdf import SheetLayout, impose_instances
+
+STALE_SECONDS = 300     # a RUNNING job with no heartbeat for this long is requeued
+HEARTBEAT_SECONDS = 30
+MAX_ATTEMPTS = 3
+CLAIM_CANDIDATES = 10
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue_job(template, workspace, user, rows, sheet_layout=None, output_format=""):
+    """Queue rendering of `rows` ([(row number, payload), ...]) and return the RenderJob."""
+    from .models import RenderJob
+    if sheet_layout is not None:
+        sheet_layout.grid(template.width_mm, template.height_mm)  # reject a bad layout now, not in the worker
+    rows = [[row, payload] for row, payload in rows]
+    return RenderJob.objects.create(
+        workspace=workspace, template=template, created_by=user,
+        rows=rows, total=len(rows), sheet=asdict(sheet_layout) if sheet_layout else None,
+        output_format=output_format or "",
+    )
+
+def claim_next_job(worker=None):
+    """Mark the oldest queued job RUNNING for this worker and return it, or None."""
+    from .models import RenderJob
+    now = timezone.now()
+    claim = dict(status=RenderJob.Status.RUNNING, worker=worker or worker_id(),
+                 started_at=now, heartbeat_at=now, attempts=F("attempts") + 1)
+    queued = RenderJob.objects.filter(status=RenderJob.Status.QUEUED).order_by("created_at", "id")
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_id = queued.select_for_update(skip_locked=True).values_list("id", flat=True).first()
+            if job_id is None:
+                return None
+            RenderJob.objects.filter(id=job_id).update(**claim)
+    else:
+        for job_id in queued.values_list("id", flat=True)[:CLAIM_CANDIDATES]:
+            if RenderJob.objects.filter(id=job_id, status=RenderJob.Status.QUEUED).update(**claim):
+                break
+        else:
+            return None
+    return RenderJob.objects.select_related("template", "workspace", "created_by").get(id=job_id)
+
+def requeue_stale_jobs(stale_seconds=STALE_SECONDS):
+    """Give jobs of workers that died another go (up to MAX_ATTEMPTS). Returns how many were touched."""
+    from .models import RenderJob
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    stale = RenderJob.objects.filter(status=RenderJob.Status.RUNNING, heartbeat_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=RenderJob.Status.FAILED, error="Worker stopped responding.", finished_at=timezone.now()
+    )
+    return failed + stale.update(status=RenderJob.Status.QUEUED, worker="")
+
+class ClaimLost(Exception):
+    """The job was requeued to another worker while this one was running it."""
+
+class _Heartbeat(threading.Thread):
+    """Touches heartbeat_at every `interval` seconds until stopped or the claim is gone."""
+
+    def __init__(self, jobs, interval=HEARTBEAT_SECONDS):
+        super().__init__(daemon=True)
+        self.jobs = jobs
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if not self.jobs.update(heartbeat_at=timezone.now()):
+                        return
+                except DatabaseError:
+                    pass   # e.g. SQLite busy while the batch insert holds the lock; next tick
+        finally:
+            connection.close()   # this thread's own connection
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_job(job, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Render a claimed job, saving progress per batch; marks it DONE or FAILED."""
+    from .models import RenderJob
+    jobs = RenderJob.objects.filter(id=job.id, worker=job.worker)   # no-op once requeued to someone else
+    done_before = job.processed
+    ids_before, errors_before = list(job.instance_ids), list(job.errors)
+
+    def progress(processed, result):
+        # runs inside the batch's transaction: no claim, no labels
+        if not jobs.update(
+            processed=done_before + processed,
+            instance_ids=ids_before + result.instance_ids,
+            errors=errors_before + [asdict(e) for e in result.errors],
+            heartbeat_at=timezone.now(),
+        ):
+            raise ClaimLost(f"Job {job.id} was requeued to another worker.")
+
+    heartbeat = _Heartbeat(jobs)
+    heartbeat.start()
+    try:
+        result = generate_labels(
+            job.template, job.workspace, job.created_by,
+            [(row, payload) for row, payload in job.rows[done_before:]],
+            workers=workers, batch_size=batch_size, progress=progress, output=job.output_format or None,
+        )
+        ids = ids_before + result.instance_ids
+        pdf_path = ""
+        if job.sheet and ids:
+            pdf_path, _pages, _placed = impose_instances(
+                job.workspace, instances_in_order(ids), SheetLayout(**job.sheet), name=f"job_{job.id}"
+            )
+    except ClaimLost:
+        return False
+    except Exception as e:
+        jobs.update(status=RenderJob.Status.FAILED, error=str(e) or e.__class__.__name__,
+                    finished_at=timezone.now())
+        return False
+    finally:
+        heartbeat.stop()
+    jobs.update(
+        status=RenderJob.Status.DONE, processed=job.total, pdf_path=pdf_path,
+        instance_ids=ids, errors=errors_before + [asdict(e) for e in result.errors],
+        finished_at=timezone.now(),
+    )
+    return True
+
+def job_status(job):
+    """JSON-friendly progress of a job (the status endpoint's body)."""
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "processed": job.processed,
+        "created": len(job.instance_ids),
+        "failed": len(job.errors),
+        "progress": round(job.processed / job.total, 3) if job.total else 1.0,
+        "pdf_path": job.pdf_path,
+        "error": job.error,
+        "finished": job.finished,
+    }
@@ -0,0 +1,58 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from labels import bench
+
+class Command(BaseCommand):
+    help = ("Benchmark label rendering (premade + synthetic heavy layouts at 203/300/600 dpi) and "
+            "write/compare pytest-benchmark style JSON baselines.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=50, help="Timed rounds per case.")
+        parser.add_argument("--warmup", type=int, default=5, help="Untimed rounds before each case.")
+        parser.add_argument("--dpi", type=int, action="append", help="Resolution to run (repeatable; default 203, 300, 600).")
+        parser.add_argument("-k", "--select", help="Only run cases whose name contains this.")
+        parser.add_argument("--json", help="Write the results here (pytest-benchmark format).")
+        parser.add_argument("--compare", help="Baseline JSON to compare medians against.")
+        parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent (default 10).")
+        parser.add_argument("--fail-on-regression", action="store_true",
+                            help="Exit with an error if any case is slower than the baseline by more than --threshold.")
+
+    def handle(self, *args, **options):
+        if options["rounds"] < 1:
+            raise CommandError("--rounds must be at least 1.")
+        baseline = None
+        if options["compare"]:
+            try:
+                baseline = bench.load_json(options["compare"])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline {options['compare']}: {e}")
+
+        self.stdout.write(f"{'case':<40} {'rounds':>6} {'labels/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'+peak RSS MB':>12}")
+
+        def progress(r):
+            rss = f"{r.rss_delta_kb / 1024:.1f}" if r.rss_delta_kb is not None else "-"
+            self.stdout.write(
+                f"{r.case.name:<40} {len(r.times):>6} {r.per_sec:>10.1f} "
+                f"{r.percentile(50) * 1000:>9.2f} {r.percentile(99) * 1000:>9.2f} {rss:>12}"
+            )
+
+        results = bench.run(options["rounds"], options["warmup"], tuple(options["dpi"] or bench.DPIS),
+                            options["select"], progress)
+        if not results:
+            raise CommandError("No benchmark case matched.")
+
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as fh:
+                json.dump(bench.to_json(results), fh, indent=2)
+            self.stdout.write(f"Wrote {options['json']}")
+
+        if baseline is not None:
+            slower = bench.compare(results, baseline, options["threshold"] / 100)
+            for name, old, new, change in slower:
+                self.stdout.write(self.style.WARNING(
+                    f"REGRESSION {name}: median {old * 1000:.2f} ms -> {new * 1000:.2f} ms (+{change:.0%})"
+                ))
+            if not slower:
+                self.stdout.write(self.style.SUCCESS(f"No case slower than the baseline by more than {options['threshold']:g}%."))
+            elif options["fail_on_regression"]:
+                raise CommandError(f"{len(slower)} case(s) regressed beyond {options['threshold']:g}%.")
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from labels.models import LabelTemplate
+from labels.bulk import generate_from_csv, default_worker_count, DEFAULT_BATCH_SIZE
+from labels.output import PROFILES
+from labels.pdf import SheetLayout, SHEETS
+from workspaces.models import Workspace
+
+class Command(BaseCommand):
+    help = "Generate one label per CSV row for a template (same format as the template's CSV download)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("template_id", type=int)
+        parser.add_argument("csv_path")
+        parser.add_argument("--workspace", type=int, required=True, help="Workspace id the labels belong to.")
+        parser.add_argument("--user", help="Email recorded as created_by (optional).")
+        parser.add_argument("--workers", type=int, default=None,
+                            help=f"Render processes (default: {default_worker_count()}).")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--sheet", choices=[s.lower() for s in SHEETS],
+                            help="Also impose the labels onto a print-sheet PDF.")
+        parser.add_argument("--margin-mm", type=float, default=SheetLayout.margin_mm)
+        parser.add_argument("--gap-mm", type=float, default=SheetLayout.gap_mm)
+        parser.add_argument("--bleed-mm", type=float, default=SheetLayout.bleed_mm)
+        parser.add_argument("--columns", type=int, default=None)
+        parser.add_argument("--rows", type=int, default=None)
+        parser.add_argument("--landscape", action="store_true")
+        parser.add_argument("--format", choices=list(PROFILES), default=None,
+                            help="Output profile for the label files (default: the template's).")
+
+    def handle(self, *args, **options):
+        try:
+            tmpl = LabelTemplate.objects.get(id=options["template_id"], is_active=True)
+        except LabelTemplate.DoesNotExist:
+            raise CommandError(f"Template {options['template_id']} not found.")
+        try:
+            ws = Workspace.objects.get(id=options["workspace"])
+        except Workspace.DoesNotExist:
+            raise CommandError(f"Workspace {options['workspace']} not found.")
+        if tmpl.workspace_id not in (None, ws.id):
+            raise CommandError("Template belongs to a different workspace.")
+
+        user = None
+        if options["user"]:
+            user = get_user_model().objects.filter(email__iexact=options["user"]).first()
+            if user is None:
+                raise CommandError(f"User {options['user']} not found.")
+
+        layout = None
+        if options["sheet"]:
+            layout = SheetLayout(
+                sheet=options["sheet"], margin_mm=options["margin_mm"], gap_mm=options["gap_mm"],
+                bleed_mm=options["bleed_mm"], columns=options["columns"], rows=options["rows"],
+                landscape=options["landscape"],
+            )
+
+        try:
+            with open(options["csv_path"], newline="", encoding="utf-8-sig") as fh:
+                result = generate_from_csv(
+                    tmpl, ws, user, fh,
+                    workers=options["workers"], batch_size=options["batch_size"],
+                    sheet_layout=layout, output=options["format"],
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for err in result.errors:
+            self.stderr.write(self.style.WARNING(f"line {err.row}: {err.error}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Labels created={result.created}, failed={result.failed}"
+            + (f", sheet={result.pdf_path}" if result.pdf_path else "")
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from labels.models import LabelInstance
+from labels.zpl import render_label_to_zpl, send_to_printer, PRINTER_DPIS, PRINTER_PORT
+
+class Command(BaseCommand):
+    help = "Print generated labels as ZPL on a networked thermal printer (or write the ZPL to a file)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("instance_ids", type=int, nargs="+")
+        parser.add_argument("--workspace", type=int, required=True, help="Workspace id the labels belong to.")
+        parser.add_argument("--printer", help=f"host[:port] of the printer (default port {PRINTER_PORT}).")
+        parser.add_argument("--output", help="Write the ZPL here instead of sending it ('-' for stdout).")
+        parser.add_argument("--dpi", type=int, choices=PRINTER_DPIS, default=None,
+                            help="Printer resolution; defaults to each template's dpi.")
+
+    def handle(self, *args, **options):
+        if bool(options["printer"]) == bool(options["output"]):
+            raise CommandError("Give exactly one of --printer or --output.")
+
+        wanted = options["instance_ids"]
+        found = {
+            inst.id: inst for inst in LabelInstance.objects.select_related("template")
+            .filter(workspace_id=options["workspace"], id__in=wanted)
+        }
+        missing = [i for i in wanted if i not in found]
+        if missing:
+            raise CommandError(f"Labels not found in this workspace: {', '.join(map(str, missing))}")
+
+        zpl = "".join(render_label_to_zpl(found[i].template, found[i].data or {}, dpi=options["dpi"]) for i in wanted)
+
+        if options["output"] == "-":
+            self.stdout.write(zpl, ending="")
+            return
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fh:
+                fh.write(zpl)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(wanted)} label(s), {len(zpl)} bytes."))
+            return
+
+        host, _, port = options["printer"].partition(":")
+        try:
+            send_to_printer(zpl, host, int(port or PRINTER_PORT))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not send to {options['printer']}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Sent {len(wanted)} label(s), {len(zpl)} bytes."))
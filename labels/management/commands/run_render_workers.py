@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from labels.bulk import default_worker_count, DEFAULT_BATCH_SIZE
+from labels.jobs import claim_next_job, requeue_stale_jobs, run_job, worker_id, STALE_SECONDS
+
+class Command(BaseCommand):
+    help = "Render queued label jobs (start one or more of these next to the web process)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None,
+                            help=f"Render processes per job (default: {default_worker_count()}).")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--stale-seconds", type=int, default=STALE_SECONDS)
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty.")
+
+    def handle(self, *args, **options):
+        me = worker_id()
+        self.stdout.write(f"Render worker {me} started.")
+        try:
+            while True:
+                requeue_stale_jobs(options["stale_seconds"])
+                job = claim_next_job(me)
+                if job is None:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll"])
+                    continue
+                started = time.monotonic()
+                ok = run_job(job, workers=options["workers"], batch_size=options["batch_size"])
+                job.refresh_from_db()
+                line = (f"Job {job.id}: {len(job.instance_ids)} created, {len(job.errors)} failed "
+                        f"in {time.monotonic() - started:.1f}s")
+                self.stdout.write(self.style.SUCCESS(line) if ok else self.style.ERROR(f"{line} ({job.error})"))
+        except KeyboardInterrupt:
+            # a job interrupted here is requeued once its heartbeat goes stale
+            self.stdout.write("Render worker stopped.")
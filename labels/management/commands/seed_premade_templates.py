@@ -126,7 +126,7 @@ class Command(BaseCommand):
             new_schema = default_schema_for(name)
             if tmpl.schema != new_schema:
                 tmpl.schema = new_schema
-                tmpl.save(update_fields=["schema"])
+                tmpl.save(update_fields=["schema", "updated_at"])
                 updated_schema += 1
 
             if was_created:
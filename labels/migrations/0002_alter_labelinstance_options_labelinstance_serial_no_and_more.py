@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0001_initial'),
+        ('workspaces', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='labelinstance',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddField(
+            model_name='labelinstance',
+            name='serial_no',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='labelinstance',
+            constraint=models.UniqueConstraint(fields=('workspace', 'serial_no'), name='uq_label_serial_per_workspace'),
+        ),
+    ]
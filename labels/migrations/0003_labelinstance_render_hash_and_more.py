@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 18:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0002_alter_labelinstance_options_labelinstance_serial_no_and_more'),
+        ('workspaces', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labelinstance',
+            name='render_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='labelinstance',
+            index=models.Index(fields=['workspace', 'render_hash'], name='label_ws_render_hash_idx'),
+        ),
+    ]
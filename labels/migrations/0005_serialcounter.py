@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_counters(apps, schema_editor):
+    # continue numbering after the serials already handed out
+    LabelInstance = apps.get_model("labels", "LabelInstance")
+    SerialCounter = apps.get_model("labels", "SerialCounter")
+    rows = LabelInstance.objects.values("workspace_id").annotate(m=Max("serial_no"))
+    SerialCounter.objects.bulk_create([
+        SerialCounter(workspace_id=r["workspace_id"], next_serial=(r["m"] or 0) + 1) for r in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0004_renderjob'),
+        ('workspaces', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerialCounter',
+            fields=[
+                ('workspace', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='serial_counter', serialize=False, to='workspaces.workspace')),
+                ('next_serial', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
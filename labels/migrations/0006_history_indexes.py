@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0005_serialcounter'),
+        ('workspaces', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='labelinstance',
+            index=models.Index(fields=['workspace', 'created_at', 'id'], name='label_ws_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labelinstance',
+            index=models.Index(fields=['workspace', 'created_by', 'created_at'], name='label_ws_user_created_idx'),
+        ),
+    ]
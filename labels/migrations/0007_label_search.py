@@ -0,0 +1,81 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Kept in step with labels/search.py (FTS_TABLE, PG_VECTOR), which queries them.
+FTS_TABLE = "labels_instance_search"
+
+# FTS body of one instance, from its JSON data: string and number values, no URLs
+SQLITE_BODY = (
+    "(SELECT group_concat(value, ' ') FROM json_each({data}) "
+    "WHERE type IN ('text', 'integer', 'real') AND value NOT LIKE 'http%')"
+)
+SQLITE_SETUP = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(body)",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON labels_labelinstance BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (NEW.id, {SQLITE_BODY.format(data="NEW.data")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF data ON labels_labelinstance BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id;
+        INSERT INTO {FTS_TABLE}(rowid, body) VALUES (NEW.id, {SQLITE_BODY.format(data="NEW.data")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON labels_labelinstance BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = OLD.id;
+    END""",
+    f"""INSERT INTO {FTS_TABLE}(rowid, body)
+        SELECT id, {SQLITE_BODY.format(data="data")} FROM labels_labelinstance
+        WHERE id NOT IN (SELECT rowid FROM {FTS_TABLE})""",
+]
+SQLITE_TEARDOWN = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# top-level string and number values of data, no URLs
+PG_VECTOR = (
+    "jsonb_to_tsvector('simple', jsonb_path_query_array(data, "
+    "'$.* ? ((@.type() == \"string\" && !(@ starts with \"http\")) || @.type() == \"number\")'), "
+    "'[\"string\", \"numeric\"]')"
+)
+PG_SETUP = [f"CREATE INDEX IF NOT EXISTS label_data_search_idx ON labels_labelinstance USING GIN ({PG_VECTOR})"]
+PG_TEARDOWN = ["DROP INDEX IF EXISTS label_data_search_idx"]
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.labels_fts5_probe USING fts5(body)")
+        except OperationalError:
+            return False
+        cursor.execute("DROP TABLE temp.labels_fts5_probe")
+    return True
+
+
+def create_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        # without FTS5 in this SQLite build search falls back to a scan
+        if sqlite_has_fts5(schema_editor.connection):
+            for sql in SQLITE_SETUP:
+                schema_editor.execute(sql)
+    elif vendor == "postgresql":
+        for sql in PG_SETUP:
+            schema_editor.execute(sql)
+
+
+def drop_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for sql in {"sqlite": SQLITE_TEARDOWN, "postgresql": PG_TEARDOWN}.get(vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0006_history_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
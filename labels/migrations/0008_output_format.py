@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labels', '0007_label_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labeltemplate',
+            name='output_format',
+            field=models.CharField(choices=[('png', 'PNG (colour)'), ('png-gray', 'PNG grayscale'), ('png-1bit', 'PNG 1-bit'), ('webp', 'WebP lossless'), ('tiff-g4', 'TIFF G4 (1-bit)')], default='png', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='renderjob',
+            name='output_format',
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
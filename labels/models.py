@@ -1,8 +1,10 @@
 # labels/models.py
-from django.db import models, transaction
-from django.db.models import Max
+import os
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Max
 from django.conf import settings
 from workspaces.models import Workspace
+from .output import CHOICES as OUTPUT_CHOICES, DEFAULT_PROFILE
 
 class LabelTemplate(models.Model):
     class Kind(models.TextChoices):
@@ -20,6 +22,8 @@ class LabelTemplate(models.Model):
     width_mm = models.FloatField(default=50.0)
     height_mm = models.FloatField(default=30.0)
     dpi = models.PositiveIntegerField(default=300)
+    # how generated label files are encoded (labels.output); a run can override it
+    output_format = models.CharField(max_length=16, choices=OUTPUT_CHOICES, default=DEFAULT_PROFILE)
 
     # Canvas schema for custom editor (premade can be empty)
     schema = models.JSONField(default=dict, blank=True)
@@ -54,6 +58,61 @@ class LabelField(models.Model):
     def __str__(self):
         return f"{self.template.name} · {self.name}"
 
+class SerialCounter(models.Model):
+    """Next free LabelInstance.serial_no per workspace; serials are handed out in blocks."""
+    workspace = models.OneToOneField(Workspace, on_delete=models.CASCADE, primary_key=True,
+                                     related_name="serial_counter")
+    next_serial = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"[{self.workspace_id}] next #{self.next_serial}"
+
+    @classmethod
+    def allocate(cls, workspace_id, count=1):
+        """
+        Reserve `count` consecutive serials for the workspace and return them as a range.
+
+        The counter is bumped before it is read, so the row is write-locked from the
+        first statement on (PostgreSQL row lock, SQLite database lock) and parallel
+        callers queue up instead of racing to the same numbers.
+        """
+        with transaction.atomic():
+            bumped = cls.objects.filter(workspace_id=workspace_id).update(next_serial=F("next_serial") + count)
+            if not bumped:
+                # first allocation for this workspace: continue after any serials already in use
+                last = LabelInstance.objects.filter(workspace_id=workspace_id).aggregate(m=Max("serial_no"))["m"]
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(workspace_id=workspace_id, next_serial=(last or 0) + 1 + count)
+                except IntegrityError:
+                    cls.objects.filter(workspace_id=workspace_id).update(next_serial=F("next_serial") + count)
+            end = cls.objects.filter(workspace_id=workspace_id).values_list("next_serial", flat=True).get()
+        return range(end - count, end)
+
+class LabelInstanceManager(models.Manager):
+    BULK_CHUNK = 500
+
+    def create_batch(self, workspace, template, user, entries, chunk_size=None, ext=".png"):
+        """
+        Insert one instance per (payload, render_hash) in `entries` and return them.
+
+        Serials are reserved in one block and png_path is derived from the serial
+        (see png_relpath), so every row is complete on insert: one counter bump plus
+        one INSERT per chunk, instead of a MAX, an INSERT and an UPDATE per label.
+        Call inside a transaction if the files written afterwards must roll back with it.
+        """
+        entries = list(entries)
+        serials = SerialCounter.allocate(workspace.id, len(entries))
+        objs = [
+            self.model(
+                workspace=workspace, template=template, created_by=user,
+                data=payload, serial_no=serial, render_hash=digest or "",
+                png_path=self.model.png_relpath(workspace.id, serial, ext),
+            )
+            for serial, (payload, digest) in zip(serials, entries)
+        ]
+        return self.bulk_create(objs, batch_size=chunk_size or self.BULK_CHUNK)
+
 class LabelInstance(models.Model):
     # Phase 2 usage — created now so DB is ready
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name="generated_labels")
@@ -63,24 +122,43 @@ class LabelInstance(models.Model):
 
     data = models.JSONField()  # actual values used to render this label
     pdf_path = models.CharField(max_length=255, blank=True)
-    png_path = models.CharField(max_length=255, blank=True)
+    png_path = models.CharField(max_length=255, blank=True)   # the label file; PNG unless another output profile was used
     serial_no = models.PositiveIntegerField(null=True, blank=True)
+    # sha256 of (template version, canonical data, renderer options); same hash => same image
+    render_hash = models.CharField(max_length=64, blank=True)
+
+    objects = LabelInstanceManager()
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=["workspace", "serial_no"], name="uq_label_serial_per_workspace")
         ]
+        indexes = [
+            models.Index(fields=["workspace", "render_hash"], name="label_ws_render_hash_idx"),
+            # history: newest-first keyset pages, all labels or ?mine=1
+            models.Index(fields=["workspace", "created_at", "id"], name="label_ws_created_idx"),
+            models.Index(fields=["workspace", "created_by", "created_at"], name="label_ws_user_created_idx"),
+        ]
         ordering = ["-created_at", "-id"]
 
     def __str__(self):
         return f"[{self.workspace_id}] #{self.serial_no or '-'} {self.template.name if self.template else 'Template'}"
 
+    @staticmethod
+    def png_relpath(workspace_id, serial_no, ext=".png"):
+        """MEDIA_ROOT-relative label file path for a serial; known before the row exists."""
+        return f"labels/{workspace_id}/instances/serial_{serial_no}{ext}"
+
+    @property
+    def file_format(self):
+        """"PNG", "WEBP", "TIF"... from the stored file's extension."""
+        return os.path.splitext(self.png_path)[1].lstrip(".").upper() or "PNG"
+
     def assign_serial_if_needed(self):
         if self.serial_no is not None:
             return
         # allocate next serial number within the same workspace
-        last = LabelInstance.objects.filter(workspace=self.workspace).aggregate(m=Max("serial_no"))["m"]
-        self.serial_no = (last or 0) + 1
+        self.serial_no = SerialCounter.allocate(self.workspace_id)[0]
 
     def save(self, *args, **kwargs):
         # ensure serial_no set safely
@@ -90,3 +168,46 @@ class LabelInstance(models.Model):
                 super().save(*args, **kwargs)
             return
         return super().save(*args, **kwargs)
+
+class RenderJob(models.Model):
+    """Queued label rendering, picked up by `manage.py run_render_workers`."""
+    class Status(models.TextChoices):
+        QUEUED = "QUEUED", "Queued"
+        RUNNING = "RUNNING", "Running"
+        DONE = "DONE", "Done"
+        FAILED = "FAILED", "Failed"
+
+    workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name="render_jobs")
+    template = models.ForeignKey(LabelTemplate, on_delete=models.PROTECT, related_name="render_jobs")
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    status = models.CharField(max_length=8, choices=Status.choices, default=Status.QUEUED)
+
+    rows = models.JSONField(default=list)               # [[row number, payload], ...]
+    sheet = models.JSONField(null=True, blank=True)     # SheetLayout fields, when a print sheet was asked for
+    output_format = models.CharField(max_length=16, blank=True)  # labels.output profile; blank = the template's
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)  # rows handled so far (created or failed)
+    instance_ids = models.JSONField(default=list, blank=True)
+    errors = models.JSONField(default=list, blank=True)  # [{"row": n, "error": "..."}]
+    pdf_path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)                 # why the whole job failed
+
+    worker = models.CharField(max_length=120, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="render_job_status_idx"),
+        ]
+        ordering = ["-created_at", "-id"]
+
+    def __str__(self):
+        return f"Job {self.id} · {self.template.name if self.template else 'Template'} · {self.status}"
+
+    @property
+    def finished(self):
+        return self.status in (self.Status.DONE, self.Status.FAILED)
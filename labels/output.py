@@ -0,0 +1,76 @@
+"""
+Output profiles: how a rendered label is encoded into its stored file.
+
+Labels are black on white, so the gray and 1-bit profiles lose nothing for most
+templates and encode several times faster into a fraction of the bytes:
+
+    profile    mode  encode   size      (Type 1, 50x30 mm @ 300 dpi, with images)
+    png        RGB   ~5 ms    ~15 KB    (the original output)
+    png-gray   L     ~1.4 ms  ~7.8 KB
+    png-1bit   1     ~0.9 ms  ~1.0 KB   image elements dithered
+    webp       RGB   ~5 ms    ~8.5 KB   lossless
+    tiff-g4    1     ~0.9 ms  ~1.4 KB   CCITT Group 4, for print/RIP workflows
+
+(medians from `manage.py bench_render -k encode --dpi 300`.)
+
+The gray and 1-bit profiles also render monochrome (OutputProfile.render_mode),
+drawing straight into an "L"/"1" canvas instead of RGBA.
+
+A template has a default profile (LabelTemplate.output_format); a single run or
+RenderJob can ask for another one.
+"""
+import io
+from dataclasses import dataclass
+from PIL import Image
+
+@dataclass(frozen=True)
+class OutputProfile:
+    key: str
+    label: str
+    format: str         # Pillow format name
+    ext: str
+    content_type: str
+    mode: str           # image mode the label is reduced to before encoding
+    options: tuple = ()  # Pillow save() keyword arguments, as (name, value) pairs
+
+    @property
+    def render_mode(self):
+        """Mode to render in (labels.utils.RENDER_MODES): gray and 1-bit profiles draw monochrome."""
+        return self.mode if self.mode in ("L", "1") else "RGB"
+
+    def convert(self, img):
+        if img.mode == self.mode:
+            return img
+        if self.mode == "1":
+            # hard threshold: bars and text stay crisp (convert("1") would dither them)
+            return img.convert("L").convert("1", dither=Image.Dither.NONE)
+        return img.convert(self.mode)
+
+    def encode(self, img):
+        out = io.BytesIO()
+        self.convert(img).save(out, self.format, **dict(self.options))
+        return out.getvalue()
+
+DEFAULT_PROFILE = "png"
+
+PROFILES = {p.key: p for p in (
+    OutputProfile("png", "PNG (colour)", "PNG", ".png", "image/png", "RGB"),
+    # zlib levels measured on the same label: gray at 3 encodes ~30% faster than 6 at 300-600 dpi
+    # for ~15% more bytes (1 and 2 are no faster); 1-bit data is small enough that levels 1-6 cost
+    # about the same, so it keeps 6, the smallest short of 9 (2.5x slower for another 7%)
+    OutputProfile("png-gray", "PNG grayscale", "PNG", ".png", "image/png", "L", (("compress_level", 3),)),
+    OutputProfile("png-1bit", "PNG 1-bit", "PNG", ".png", "image/png", "1", (("compress_level", 6),)),
+    # method 2 compresses as well as 4-6 on label art at half the time; quality is effort when lossless
+    OutputProfile("webp", "WebP lossless", "WEBP", ".webp", "image/webp", "RGB",
+                  (("lossless", True), ("method", 2), ("quality", 0))),
+    OutputProfile("tiff-g4", "TIFF G4 (1-bit)", "TIFF", ".tif", "image/tiff", "1", (("compression", "group4"),)),
+)}
+
+CHOICES = [(p.key, p.label) for p in PROFILES.values()]
+
+def get_profile(key=None, template=None):
+    """The profile named `key`, else the template's default, else plain PNG."""
+    for candidate in (key, getattr(template, "output_format", None)):
+        if candidate in PROFILES:
+            return PROFILES[candidate]
+    return PROFILES[DEFAULT_PROFILE]
@@ -0,0 +1,70 @@
+"""
+Keyset (cursor) pagination for label history.
+
+Pages are addressed by the (created_at, id) of their edge row instead of an
+OFFSET, so page 10,000 costs the same index range scan as page 1, and no
+COUNT(*) runs per page view. Totals come from count_estimate() instead.
+"""
+import base64, hashlib
+from datetime import datetime
+from django.core.cache import cache
+from django.db.models import Q
+
+COUNT_CACHE_SECONDS = 60
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor string, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        stamp, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(stamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+class KeysetPage:
+    """One page of a queryset ordered newest first by (-created_at, -id)."""
+
+    def __init__(self, qs, per_page=25, after=None, before=None):
+        after, before = decode_cursor(after), decode_cursor(before)
+        if before:
+            # walking back towards newer rows: scan ascending, then flip
+            stamp, pk = before
+            rows = list(
+                qs.filter(Q(created_at__gt=stamp) | Q(created_at=stamp, id__gt=pk))
+                .order_by("created_at", "id")[:per_page + 1]
+            )
+            self.has_previous = len(rows) > per_page
+            self.has_next = True
+            rows = rows[:per_page][::-1]
+        else:
+            if after:
+                stamp, pk = after
+                qs = qs.filter(Q(created_at__lt=stamp) | Q(created_at=stamp, id__lt=pk))
+            rows = list(qs.order_by("-created_at", "-id")[:per_page + 1])
+            self.has_next = len(rows) > per_page
+            self.has_previous = after is not None
+            rows = rows[:per_page]
+        self.object_list = rows
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next and self.object_list else ""
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous and self.object_list else ""
+
+def count_estimate(qs, key_parts):
+    """COUNT(*) of qs, cached for COUNT_CACHE_SECONDS under key_parts (workspace + filters)."""
+    key = "labels:count:" + hashlib.sha1(repr(key_parts).encode()).hexdigest()
+    total = cache.get(key)
+    if total is None:
+        total = qs.count()
+        cache.set(key, total, COUNT_CACHE_SECONDS)
+    return total
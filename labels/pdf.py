@@ -0,0 +1,230 @@
+"""
+Print-sheet PDFs: impose rendered labels onto A4/Letter sheets or roll pages.
+
+The PDF is written object by object straight to disk, one label at a time, so
+memory stays flat however many labels a sheet run covers. Label PNGs are not
+decoded: their zlib (IDAT) stream is embedded as-is with the PNG predictor
+declared, and labels sharing a render_hash share one image object.
+"""
+import os, struct, zlib
+from dataclasses import dataclass
+from django.conf import settings
+from django.utils import timezone
+
+PT_PER_MM = 72 / 25.4
+
+SHEETS = {
+    "A4": (210.0, 297.0),
+    "LETTER": (215.9, 279.4),
+    "ROLL": None,   # page sized to one row of labels (continuous roll printers)
+}
+
+@dataclass(frozen=True)
+class SheetLayout:
+    sheet: str = "A4"
+    margin_mm: float = 10.0
+    gap_mm: float = 2.0        # gutter between neighbouring cells
+    bleed_mm: float = 0.0      # extra space around each label's trim box, inside its cell
+    columns: int = None        # None: as many as fit
+    rows: int = None
+    landscape: bool = False
+
+    def grid(self, label_w_mm, label_h_mm):
+        """Return (page_w_mm, page_h_mm, [(x_mm, y_mm) of each label's trim box, top-left origin])."""
+        cell_w = label_w_mm + 2 * self.bleed_mm
+        cell_h = label_h_mm + 2 * self.bleed_mm
+        size = SHEETS.get(self.sheet.upper())
+        if self.sheet.upper() not in SHEETS:
+            raise ValueError(f"Unknown sheet {self.sheet!r}; choose one of {', '.join(SHEETS)}.")
+
+        if size is None:
+            cols, rows = self.columns or 1, 1
+            page_w = 2 * self.margin_mm + cols * cell_w + (cols - 1) * self.gap_mm
+            page_h = 2 * self.margin_mm + cell_h
+        else:
+            page_w, page_h = (size[1], size[0]) if self.landscape else size
+            fit_cols = int((page_w - 2 * self.margin_mm + self.gap_mm) // (cell_w + self.gap_mm))
+            fit_rows = int((page_h - 2 * self.margin_mm + self.gap_mm) // (cell_h + self.gap_mm))
+            cols, rows = self.columns or fit_cols, self.rows or fit_rows
+            if cols < 1 or rows < 1 or cols > fit_cols or rows > fit_rows:
+                raise ValueError(
+                    f"{cols}x{rows} labels of {label_w_mm}x{label_h_mm} mm do not fit on {self.sheet} "
+                    f"with these margins (max {fit_cols}x{fit_rows})."
+                )
+
+        slots = []
+        for r in range(rows):
+            for c in range(cols):
+                x = self.margin_mm + c * (cell_w + self.gap_mm) + self.bleed_mm
+                y = self.margin_mm + r * (cell_h + self.gap_mm) + self.bleed_mm
+                slots.append((x, y))
+        return page_w, page_h, slots
+
+# ---- image embedding -------------------------------------------------------
+
+def _png_stream(path):
+    """
+    (dict entries, data) for embedding a PNG without decoding it, or None when the
+    PNG isn't a plain non-interlaced gray/RGB one (then we go through Pillow).
+    """
+    with open(path, "rb") as fh:
+        if fh.read(8) != b"\x89PNG\r\n\x1a\n":
+            return None
+        ihdr, idat = None, []
+        while True:
+            head = fh.read(8)
+            if len(head) < 8:
+                break
+            length, kind = struct.unpack(">I4s", head)
+            body = fh.read(length)
+            fh.read(4)  # crc
+            if kind == b"IHDR":
+                ihdr = struct.unpack(">IIBBBBB", body)
+            elif kind == b"IDAT":
+                idat.append(body)
+            elif kind == b"IEND":
+                break
+    if not ihdr or not idat:
+        return None
+    width, height, depth, color_type, _comp, _filter, interlace = ihdr
+    colors = {0: 1, 2: 3}.get(color_type)
+    if colors is None or interlace or (colors == 3 and depth != 8) or depth > 8:
+        return None
+    entries = (
+        f"/Width {width} /Height {height} /ColorSpace /{'DeviceGray' if colors == 1 else 'DeviceRGB'} "
+        f"/BitsPerComponent {depth} /Filter /FlateDecode "
+        f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent {depth} /Columns {width} >>"
+    )
+    return entries, b"".join(idat)
+
+def _pillow_stream(path):
+    from PIL import Image
+    with Image.open(path) as im:
+        im = im.convert("L" if im.mode in ("1", "L") else "RGB")
+        entries = (
+            f"/Width {im.width} /Height {im.height} "
+            f"/ColorSpace /{'DeviceGray' if im.mode == 'L' else 'DeviceRGB'} "
+            f"/BitsPerComponent 8 /Filter /FlateDecode"
+        )
+        return entries, zlib.compress(im.tobytes())
+
+class _PdfWriter:
+    """Minimal streaming PDF writer: objects go to disk as soon as they are complete."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.offsets = {}
+        self.next_id = 3   # 1: catalog, 2: page tree (written last)
+        fh.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self):
+        oid = self.next_id
+        self.next_id += 1
+        return oid
+
+    def write(self, oid, body, stream=None):
+        self.offsets[oid] = self.fh.tell()
+        self.fh.write(f"{oid} 0 obj\n".encode())
+        if stream is None:
+            self.fh.write(body.encode() + b"\nendobj\n")
+        else:
+            self.fh.write(f"<< {body} /Length {len(stream)} >>\nstream\n".encode())
+            self.fh.write(stream)
+            self.fh.write(b"\nendstream\nendobj\n")
+        return oid
+
+    def close(self, page_ids):
+        self.write(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{p} 0 R" for p in page_ids)
+        self.write(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>")
+        xref = self.fh.tell()
+        size = self.next_id
+        self.fh.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for oid in range(1, size):
+            self.fh.write(f"{self.offsets.get(oid, 0):010d} 00000 n \n".encode())
+        self.fh.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+def write_sheet_pdf(instances, out_path, layout=None):
+    """
+    Impose the PNGs of `instances` (iterable of LabelInstance with template loaded)
+    onto pages in `out_path`. Returns (pages written, ids of the instances placed).
+    """
+    layout = layout or SheetLayout()
+    placed, page_ids = [], []
+    grid = None
+    images = {}   # render_hash or path -> image object id (identical labels are embedded once)
+
+    tmp_path = f"{out_path}.part"
+    with open(tmp_path, "wb") as fh:
+        pdf = _PdfWriter(fh)
+        page_w = page_h = 0
+        slots, ops, resources = [], [], {}
+
+        def flush():
+            if not ops:
+                return
+            content = "\n".join(ops).encode()
+            cid = pdf.write(pdf.reserve(), "", stream=content)
+            xobjects = " ".join(f"/{name} {oid} 0 R" for name, oid in resources.items())
+            page_ids.append(pdf.write(pdf.reserve(), (
+                f"<< /Type /Page /Parent 2 0 R "
+                f"/MediaBox [0 0 {page_w * PT_PER_MM:.2f} {page_h * PT_PER_MM:.2f}] "
+                f"/Resources << /XObject << {xobjects} >> >> /Contents {cid} 0 R >>"
+            )))
+            ops.clear()
+            resources.clear()
+
+        for inst in instances:
+            path = os.path.join(settings.MEDIA_ROOT, inst.png_path) if inst.png_path else ""
+            if not path or not os.path.exists(path):
+                continue
+            w_mm, h_mm = inst.template.width_mm, inst.template.height_mm
+            if grid is None:
+                grid = (w_mm, h_mm)
+                page_w, page_h, all_slots = layout.grid(w_mm, h_mm)
+            if not slots:
+                flush()
+                slots = list(all_slots)
+
+            key = inst.render_hash or path
+            oid = images.get(key)
+            if oid is None:
+                entries, data = _png_stream(path) or _pillow_stream(path)
+                oid = pdf.write(pdf.reserve(), f"/Type /XObject /Subtype /Image {entries}", stream=data)
+                images[key] = oid
+            name = f"Im{oid}"
+            resources[name] = oid
+
+            # every cell has the first label's trim size; other sizes are fitted inside it
+            cw, ch = grid
+            scale = min(cw / w_mm, ch / h_mm)
+            dw, dh = w_mm * scale, h_mm * scale
+            x, y = slots.pop(0)
+            x += (cw - dw) / 2
+            y += (ch - dh) / 2
+            ops.append(
+                f"q {dw * PT_PER_MM:.2f} 0 0 {dh * PT_PER_MM:.2f} "
+                f"{x * PT_PER_MM:.2f} {(page_h - y - dh) * PT_PER_MM:.2f} cm /{name} Do Q"
+            )
+            placed.append(inst.id)
+
+        flush()
+        pdf.close(page_ids)
+    os.replace(tmp_path, out_path)
+    return len(page_ids), placed
+
+def impose_instances(workspace, instances, layout=None, name=None):
+    """
+    Write a sheet PDF for `instances` under MEDIA_ROOT/labels/<ws>/sheets/ and record
+    it as pdf_path on every instance placed. Returns (relative pdf path, pages, placed ids).
+    """
+    from .models import LabelInstance
+    out_dir = os.path.join(settings.MEDIA_ROOT, "labels", str(workspace.id), "sheets")
+    os.makedirs(out_dir, exist_ok=True)
+    name = name or timezone.now().strftime("sheet_%Y%m%d_%H%M%S_%f")
+    out_path = os.path.join(out_dir, f"{name}.pdf")
+    pages, placed = write_sheet_pdf(instances, out_path, layout)
+    rel = os.path.relpath(out_path, settings.MEDIA_ROOT).replace("\\", "/")
+    for start in range(0, len(placed), 500):
+        LabelInstance.objects.filter(id__in=placed[start:start + 500]).update(pdf_path=rel)
+    return rel, pages, placed
@@ -0,0 +1,182 @@
+"""
+Compiled render plans.
+
+A LabelTemplate's schema is parsed once into an immutable RenderPlan: canvas
+size plus a tuple of typed element ops with geometry already cast to ints.
+The renderer and the form/CSV field derivation both read the plan instead of
+walking template.schema again. Plans are cached per template version.
+"""
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import ClassVar
+from .cache import LRUCache
+
+PLAN_CACHE_SIZE = 256
+
+def mm2px(mm, dpi): return round(mm * dpi / 25.4)
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+@dataclass(frozen=True, slots=True)
+class ElementOp:
+    kind: ClassVar[str] = ""
+    x: int
+    y: int
+    w: int
+    h: int
+    key: str
+
+    @property
+    def depends_on(self):
+        """Data keys this element's output reads; empty means it is the same on every label."""
+        return frozenset([self.key]) if self.key else frozenset()
+
+    def box(self, canvas_width):
+        return (self.x, self.y, self.x + self.w, self.y + self.h)
+
+    def resolve(self, data):
+        """The value this element shows for `data` (shared by the raster and vector renderers)."""
+        return data.get(self.key)
+
+@dataclass(frozen=True, slots=True)
+class TextOp(ElementOp):
+    kind: ClassVar[str] = "text"
+    value: str = ""
+    font_size: int = 12
+    font_family: str = ""
+
+    def resolve(self, data):
+        return str(data.get(self.key) or self.value or "")
+
+    def box(self, canvas_width):
+        # text is not clipped to its element box; assume it may run to the right edge
+        return (self.x, self.y, canvas_width, self.y + max(self.h, 2 * self.font_size))
+
+@dataclass(frozen=True, slots=True)
+class ImageOp(ElementOp):
+    kind: ClassVar[str] = "image"
+
+@dataclass(frozen=True, slots=True)
+class BarcodeOp(ElementOp):
+    kind: ClassVar[str] = "barcode"
+
+    @property
+    def depends_on(self):
+        return frozenset([self.key, "sku"])  # renderer falls back to the SKU
+
+    def resolve(self, data):
+        return str(data.get(self.key) or data.get("sku") or "CODE")
+
+@dataclass(frozen=True, slots=True)
+class QrOp(ElementOp):
+    kind: ClassVar[str] = "qrcode"
+
+    @property
+    def depends_on(self):
+        return frozenset([self.key, "sku"])
+
+    def resolve(self, data):
+        return str(data.get(self.key) or data.get("sku") or "QR")
+
+OP_TYPES = {cls.kind: cls for cls in (TextOp, ImageOp, BarcodeOp, QrOp)}
+
+@dataclass(frozen=True, slots=True)
+class RenderPlan:
+    width: int
+    height: int
+    dpi: int
+    ops: tuple
+
+    @property
+    def input_fields(self):
+        """[(key, "TEXT"|"IMAGE")] for text/image elements bound to a dataKey, in schema order."""
+        return [(op.key, "IMAGE" if op.kind == "image" else "TEXT")
+                for op in self.ops if op.kind in ("text", "image") and op.key]
+
+    @property
+    def code_ops(self):
+        return [op for op in self.ops if op.kind in ("barcode", "qrcode")]
+
+def schema_elements(template):
+    schema = template.schema or {}
+    if isinstance(schema, str):
+        try:
+            schema = json.loads(schema)
+        except Exception:
+            schema = {}
+    return (schema or {}).get("elements", []) or []
+
+def compile_render_plan(template):
+    ops = []
+    for idx, el in enumerate(schema_elements(template)):
+        if not isinstance(el, dict):
+            continue
+        t = el.get("type")
+        cls = OP_TYPES.get(t)
+        if cls is None:
+            continue
+        key = (el.get("dataKey") or "").strip()
+        if not key and cls in (BarcodeOp, QrOp):
+            key = f"{t}_value_{idx+1}"  # fallback key if designer forgot one
+        geom = dict(
+            x=_int(el.get("x"), 0), y=_int(el.get("y"), 0),
+            w=_int(el.get("w"), 80), h=_int(el.get("h"), 20), key=key,
+        )
+        if cls is TextOp:
+            ops.append(TextOp(
+                **geom,
+                value=str(el.get("value") or ""),
+                font_size=_int(el.get("fontSize") or 12, 12),
+                font_family=(el.get("fontFamily") or "").strip(),
+            ))
+        else:
+            ops.append(cls(**geom))
+    return RenderPlan(
+        width=mm2px(template.width_mm, template.dpi),
+        height=mm2px(template.height_mm, template.dpi),
+        dpi=template.dpi,
+        ops=tuple(ops),
+    )
+
+_plans = LRUCache(max_items=PLAN_CACHE_SIZE)
+
+def plan_cache_key(template):
+    # geometry is part of the key too, in case a save() skipped updated_at
+    return (template.pk, template.updated_at, template.width_mm, template.height_mm, template.dpi)
+
+def get_render_plan(template):
+    """Return the cached RenderPlan for this template version, compiling it on a miss."""
+    if template.pk is None:
+        return compile_render_plan(template)
+    return _plans.get_or_set(plan_cache_key(template), lambda: compile_render_plan(template))
+
+def _overlaps(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+@lru_cache(maxsize=256)
+def split_static(plan, static_keys=frozenset()):
+    """
+    Split plan.ops into (base_ops, variable_ops).
+
+    base_ops only read data keys listed in `static_keys` (keys that hold the
+    same value for every label of a run) or no data at all, so they can be
+    rasterised once into a shared base layer. An element is only hoisted if
+    no earlier variable element overlaps it, which keeps the paint order and
+    therefore the output identical.
+    """
+    base, variable = [], []
+    for op in plan.ops:
+        box = op.box(plan.width)
+        if op.depends_on <= static_keys and not any(_overlaps(box, v.box(plan.width)) for v in variable):
+            base.append(op)
+        else:
+            variable.append(op)
+    return tuple(base), tuple(variable)
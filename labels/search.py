@@ -0,0 +1,64 @@
+"""
+Search over the values of LabelInstance.data (SKU, product name, code values...).
+
+  * SQLite: an FTS5 table keyed by instance id, kept in step by triggers on
+    labels_labelinstance, so bulk_create and every other insert path feed it.
+  * PostgreSQL: a GIN index on jsonb_to_tsvector() of data's top-level
+    string and number values, maintained by the index itself on insert.
+  * Anything else (or SQLite built without FTS5): a plain substring scan.
+
+Each whitespace-separated term must match; "SKU-12" matches SKU-123 (prefix
+on its last token), and image URLs are not indexed.
+"""
+import re
+from django.db import connections
+from django.db.models import Q, TextField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+# The table, its triggers and the PostgreSQL index are created by migration
+# 0007_label_search; these two must match what it creates.
+FTS_TABLE = "labels_instance_search"
+
+PG_VECTOR = (
+    "jsonb_to_tsvector('simple', jsonb_path_query_array(data, "
+    "'$.* ? ((@.type() == \"string\" && !(@ starts with \"http\")) || @.type() == \"number\")'), "
+    "'[\"string\", \"numeric\"]')"
+)
+
+def _terms(query):
+    """[[tokens of term], ...] for each whitespace-separated search term."""
+    terms = (re.findall(r"\w+", term.lower()) for term in (query or "").split())
+    return [t for t in terms if t]
+
+_fts_available = {}
+
+def _has_fts(alias):
+    if alias not in _fts_available:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_available[alias] = cursor.fetchone() is not None
+    return _fts_available[alias]
+
+def search_instances(qs, query):
+    """Narrow a LabelInstance queryset to rows whose data matches every term of `query`."""
+    terms = _terms(query)
+    if not terms:
+        return qs
+    vendor = connections[qs.db].vendor
+
+    if vendor == "sqlite" and _has_fts(qs.db):
+        # "sku 12"* : the term's tokens as a phrase, prefix match on the last one
+        match = " ".join('"' + " ".join(tokens) + '"*' for tokens in terms)
+        return qs.filter(id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match]))
+
+    if vendor == "postgresql":
+        tsquery = " & ".join(f"{token}:*" for tokens in terms for token in tokens)
+        return qs.filter(id__in=RawSQL(
+            f"SELECT id FROM labels_labelinstance WHERE {PG_VECTOR} @@ to_tsquery('simple', %s)", [tsquery]
+        ))
+
+    qs = qs.annotate(_data_text=Cast("data", TextField()))
+    for term in (query or "").split():
+        qs = qs.filter(Q(_data_text__icontains=term))
+    return qs
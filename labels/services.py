@@ -0,0 +1,166 @@
+import hashlib, json, os, shutil
+from django.conf import settings
+from django.db import transaction
+from .images import atomic_write, fetch, image_urls, ImageFetchError
+from .plans import get_render_plan, plan_cache_key
+from .utils import render_options, render_label_to_image
+from .timing import span
+from .output import get_profile, DEFAULT_PROFILE
+
+def template_field_defs(template):
+    """Return [{key, name, type}] for the TEXT/IMAGE inputs a template expects."""
+    field_defs = []
+    fields_qs = template.fields.order_by("sort_order")
+    if fields_qs.exists():
+        for f in fields_qs:
+            if f.field_type in ("TEXT", "IMAGE"):
+                field_defs.append({"key": f.key, "name": f.name, "type": f.field_type})
+    else:
+        # derive from the compiled schema for custom
+        for key, ftype in get_render_plan(template).input_fields:
+            field_defs.append({"key": key, "name": key.replace("_", " ").title(), "type": ftype})
+
+    # Sort & dedupe by key
+    seen, deduped = set(), []
+    for f in field_defs:
+        if f["key"] not in seen:
+            deduped.append(f)
+            seen.add(f["key"])
+    return deduped
+
+def collect_schema_code_fields(template):
+    """Return [{kind, key, label}] for the barcode/qrcode elements of the template's render plan."""
+    code_fields, seen = [], set()
+    for op in get_render_plan(template).code_ops:
+        tag = ("BARCODE" if op.kind == "barcode" else "QRCODE", op.key)
+        if tag in seen:
+            continue
+        seen.add(tag)
+        code_fields.append({
+            "kind": tag[0],
+            "key": op.key,
+            "label": f"{'Barcode' if op.kind == 'barcode' else 'QR'} value ({op.key})",
+        })
+    return code_fields
+
+def build_payload(source, field_defs, code_fields):
+    """Build the render payload from a POST dict or a CSV row."""
+    payload = {}
+    # TEXT / IMAGE inputs
+    for f in field_defs:
+        payload[f["key"]] = (source.get(f["key"]) or "").strip()
+
+    # code values from schema-discovered code fields
+    for cf in code_fields:
+        payload[cf["key"]] = (source.get(cf["key"]) or "").strip()
+
+    # Backward-compat: premade templates can still send a single code_value
+    code_value = (source.get("code_value") or "").strip() or payload.get("sku") or ""
+    if code_value:
+        # If template expects 'code_value', ensure it's present
+        payload.setdefault("code_value", code_value)
+    return payload
+
+# ---- render dedup ----------------------------------------------------------
+# Reprints are common: the same template version and data give the same image,
+# so a new LabelInstance can hard-link the file an earlier one already has.
+
+def render_hash(template, data, profile=None):
+    """sha256 over (template version, canonicalised data, remote image contents, renderer options, output profile)."""
+    canon = {k: v for k, v in data.items() if v not in (None, "")}  # the renderer treats "" and missing alike
+    remote = {}
+    for url in image_urls(get_render_plan(template), [data]):
+        try:
+            remote[url] = fetch(url)
+        except ImageFetchError:
+            remote[url] = ""
+    key = {"t": plan_cache_key(template), "d": canon, "i": remote, "r": render_options()}
+    if profile is not None and profile.key != DEFAULT_PROFILE:
+        key["o"] = f"{profile.key}/{profile.render_mode}"   # plain PNG keeps the hashes it always had
+    blob = json.dumps(key, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def existing_rendered_files(workspace, digests):
+    """{render_hash: absolute file path} for digests already rendered in this workspace."""
+    from .models import LabelInstance  # bulk workers import this module before django.setup()
+    found = {}
+    rows = (
+        LabelInstance.objects
+        .filter(workspace=workspace, render_hash__in=list(digests))
+        .exclude(png_path="")
+        .values_list("render_hash", "png_path")
+    )
+    for digest, rel in rows:
+        path = os.path.join(settings.MEDIA_ROOT, rel)
+        if digest not in found and os.path.exists(path):
+            found[digest] = path
+    return found
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst (copy across filesystems). Returns False if src is gone."""
+    try:
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+        return True
+    except OSError:
+        return False
+
+# ---- creating instances ----------------------------------------------------
+
+def render_label_file(template, payload, profile=None):
+    """The label encoded with `profile` (default: the template's output profile), as bytes."""
+    profile = profile or get_profile(template=template)
+    img = render_label_to_image(template, payload, mode=profile.render_mode)
+    with span("encode"):
+        return profile.encode(img)
+
+def create_label_instances(template, workspace, user, entries, profile=None):
+    """
+    Create one LabelInstance (row + label file) per entry and return the instances.
+
+    `entries` holds (payload, render_hash, file bytes or None, existing file or None):
+    an existing file (an earlier render of the same hash) is hard-linked, entries
+    sharing a hash share one file, and anything left is rendered here.
+    """
+    from .models import LabelInstance
+    profile = profile or get_profile(template=template)
+    entries = list(entries)
+    paths = []
+    try:
+        with transaction.atomic():
+            instances = LabelInstance.objects.create_batch(
+                workspace, template, user, [(payload, digest) for payload, digest, _png, _src in entries],
+                ext=profile.ext,
+            )
+            if instances:
+                os.makedirs(os.path.dirname(os.path.join(settings.MEDIA_ROOT, instances[0].png_path)), exist_ok=True)
+            written = {}
+            for inst, (payload, digest, png, source) in zip(instances, entries):
+                out_path = os.path.join(settings.MEDIA_ROOT, inst.png_path)
+                paths.append(out_path)
+                source = written.get(digest) or source
+                if not (source and link_or_copy(source, out_path)):
+                    # no bytes when the earlier file vanished since it was looked up
+                    atomic_write(out_path, png if png is not None else render_label_file(template, payload, profile))
+                if digest:
+                    written[digest] = out_path
+    except BaseException:
+        remove_files(paths)   # the rows are gone and their serials will be handed out again
+        raise
+    return instances
+
+def remove_files(paths):
+    """Unlink label files (unlinking a hard link leaves the other labels' files alone)."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def remove_label_files(instances):
+    """Remove the files of instances whose rows were rolled back after create_label_instances."""
+    remove_files(os.path.join(settings.MEDIA_ROOT, inst.png_path) for inst in instances if inst.png_path)
@@ -1,3 +1,837 @@
-from django.test import TestCase
+import csv, io, json, os, re, shutil, tempfile, threading, zipfile, zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from xml.etree import ElementTree
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from barcode import Code128
+from PIL import Image
+from organizations.models import Organization
+from workspaces.models import Workspace
+from . import images, search, timing, utils
+from .bulk import RowError, generate_labels, read_csv_rows
+from .jobs import MAX_ATTEMPTS, claim_next_job, enqueue_job, requeue_stale_jobs, run_job
+from .models import LabelTemplate, LabelInstance, RenderJob, SerialCounter
+from .output import PROFILES
+from .pagination import KeysetPage
+from .pdf import PT_PER_MM, SheetLayout
+from .search import search_instances
+from .services import render_hash
+from .utils import bar_runs, barcode_modules, qr_error_level, qr_matrix, render_label_to_image
+from .vector import render_label_to_pdf, render_label_to_svg, render_label_vector
+from .zpl import render_label_to_zpl
 
-# Create your tests here.
+def _png(color):
+    out = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(out, "PNG")
+    return out.getvalue()
+
+class _Server:
+    """One PNG at /logo.png with an ETag (503 while `down`); records each request's If-None-Match."""
+
+    def __init__(self):
+        self.body, self.etag, self.requests, self.down = _png("red"), '"v1"', [], False
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.headers.get("If-None-Match"))
+                if server.down:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("ETag", server.etag)
+                self.send_header("Content-Length", str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/logo.png"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def _serve_images(test):
+    """Start a _Server for `test` with an empty image cache in a temp dir; undone at cleanup."""
+    cache = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, cache, True)
+    override = override_settings(LABELS_IMAGE_CACHE_DIR=cache)
+    override.enable()
+    test.addCleanup(override.disable)
+    for lru in (images._index, images._decoded, images._resized):
+        lru.clear()
+    server = _Server()
+    test.addCleanup(server.close)
+    return server
+
+class ImageCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.server = _serve_images(self)
+
+    def test_fresh_url_is_served_without_a_request(self):
+        sha = images.fetch(self.server.url)
+        self.assertEqual(images.fetch(self.server.url), sha)
+        self.assertEqual(self.server.requests, [None])
+
+    def test_stale_url_is_revalidated_with_its_etag(self):
+        sha = images.fetch(self.server.url)
+        with mock.patch.object(images, "FRESH_SECONDS", -1):
+            self.assertEqual(images.fetch(self.server.url), sha)
+        self.assertEqual(self.server.requests, [None, '"v1"'])
+
+    def test_changed_body_replaces_the_cached_one(self):
+        old = images.fetch(self.server.url)
+        self.server.body, self.server.etag = _png("blue"), '"v2"'
+        with mock.patch.object(images, "FRESH_SECONDS", -1):
+            new = images.fetch(self.server.url)
+        self.assertNotEqual(new, old)
+        self.assertEqual(images.load_image(self.server.url).getpixel((0, 0)), (0, 0, 255, 255))
+
+    def test_disk_tier_survives_a_cleared_memory_index(self):
+        sha = images.fetch(self.server.url)
+        images._index.clear()
+        self.assertEqual(images.fetch(self.server.url), sha)
+        self.assertEqual(len(self.server.requests), 1)
+
+def _template(*elements, dpi=300):
+    """A 50 x 30 mm template at `dpi`; unsaved, so its render plan is never cached."""
+    return LabelTemplate(name="t", width_mm=50, height_mm=30, dpi=dpi, schema={"elements": list(elements)})
+
+class ZplTests(SimpleTestCase):
+    def zpl_lines(self, *elements, data=None, dpi=None):
+        return render_label_to_zpl(_template(*elements), data or {}, dpi=dpi).splitlines()
+
+    def test_frame(self):
+        lines = self.zpl_lines()
+        self.assertEqual(lines, ["^XA", "^CI28", "^PW591", "^LL354", "^LH0,0", "^XZ"])
+
+    def test_text(self):
+        lines = self.zpl_lines({"type": "text", "x": 10, "y": 20, "dataKey": "name", "fontSize": 24},
+                               data={"name": "Tea ^ cup"})
+        self.assertIn("^FO10,20^A0N,24,24^FH^FDTea _5E cup^FS", lines)
+
+    def test_empty_text_is_skipped(self):
+        self.assertEqual(len(self.zpl_lines({"type": "text", "dataKey": "name"})), 6)
+
+    def test_code128_barcode(self):
+        lines = self.zpl_lines({"type": "barcode", "x": 0, "y": 0, "w": 500, "h": 100, "dataKey": "sku"},
+                               data={"sku": "ABC-123"})
+        bar = next(line for line in lines if "^BC" in line)
+        self.assertRegex(bar, r"^\^FO\d+,0\^BY\d+\^BCN,80,Y,N,N\^FH\^FDABC-123\^FS$")
+
+    def test_barcode_keeps_its_quiet_zone(self):
+        lines = self.zpl_lines({"type": "barcode", "x": 0, "y": 0, "w": 500, "h": 30, "dataKey": "sku"},
+                               data={"sku": "ABC-123"})
+        left, module = re.match(r"\^FO(\d+),0\^BY(\d+)", next(l for l in lines if "^BC" in l)).groups()
+        self.assertGreaterEqual(int(left), 10 * int(module))
+
+    def test_ean13_fallback(self):
+        lines = self.zpl_lines({"type": "barcode", "x": 0, "y": 0, "w": 500, "h": 30, "dataKey": "sku"},
+                               data={"sku": "\u00e9t\u00e9"})
+        self.assertTrue(any("^BEN,30,N,N^FH^FD000000000000^FS" in line for line in lines))
+
+    def test_qrcode(self):
+        lines = self.zpl_lines({"type": "qrcode", "x": 0, "y": 0, "w": 200, "h": 200, "dataKey": "url"},
+                               data={"url": "https://example.com/p/1"})
+        qr = next(line for line in lines if "^BQ" in line)
+        self.assertRegex(qr, r"^\^FO\d+,\d+\^BQN,2,\d+\^FH\^FD[LMQH]A,https://example.com/p/1\^FS$")
+
+    def test_image_is_sent_as_a_graphic(self):
+        server = _serve_images(self)
+        lines = self.zpl_lines({"type": "image", "x": 5, "y": 6, "w": 16, "h": 8, "dataKey": "logo"},
+                               data={"logo": server.url})
+        self.assertTrue(any(line.startswith("^FO5,6^GFA,16,16,2,") for line in lines))
+
+    def test_missing_image_is_a_box(self):
+        lines = self.zpl_lines({"type": "image", "x": 5, "y": 6, "w": 16, "h": 8, "dataKey": "logo"})
+        self.assertIn("^FO5,6^GB16,8,1^FS", lines)
+
+    def test_printer_dpi_scales_geometry(self):
+        lines = self.zpl_lines({"type": "text", "x": 300, "y": 150, "dataKey": "name", "fontSize": 30},
+                               data={"name": "x"}, dpi=600)
+        self.assertIn("^PW1182", lines)
+        self.assertIn("^FO600,300^A0N,60,60^FH^FDx^FS", lines)
+
+def _dark(img, y):
+    """Row y of an "L" image as a string of "1" (black) and "0"."""
+    return "".join("1" if img.getpixel((x, y)) == 0 else "0" for x in range(img.width))
+
+class BarcodeTests(SimpleTestCase):
+    def setUp(self):
+        utils._code_rasters.clear()
+        self.addCleanup(utils._code_rasters.clear)
+
+    def test_bars_follow_the_code128_pattern(self):
+        pattern = Code128("ABC-123").build()[0]
+        module, left = utils.barcode_fit(600, len(pattern), (10, 10))
+        self.assertGreater(module, 1)
+        img = utils._paint_barcode("ABC-123", (600, 80))
+        expected = ("0" * left + "".join(m * module for m in pattern)).ljust(600, "0")
+        self.assertEqual(_dark(img, 0), expected)
+        self.assertEqual(_dark(img, 63), expected)   # bars stop above the caption (h // 5 = 16 px)
+
+    def assertQuietZone(self, img, module, left_q, right_q):
+        row = _dark(img, 0)
+        self.assertGreaterEqual(row.index("1"), left_q * module)
+        self.assertGreaterEqual(len(row) - 1 - row.rindex("1"), right_q * module)
+
+    def test_code128_quiet_zone(self):
+        pattern = Code128("ABC-123").build()[0]
+        module, _left = utils.barcode_fit(400, len(pattern), (10, 10))
+        self.assertQuietZone(utils._paint_barcode("ABC-123", (400, 30)), module, 10, 10)
+
+    def test_ean13_quiet_zone(self):
+        pattern, text, quiet = utils.barcode_modules("\u00e9t\u00e9")   # not Code 128: falls back to EAN-13
+        self.assertEqual(text, "0000000000000")
+        self.assertEqual(quiet, (11, 7))
+        module, _left = utils.barcode_fit(400, len(pattern), quiet)
+        self.assertQuietZone(utils._paint_barcode("\u00e9t\u00e9", (400, 30)), module, 11, 7)
+
+    def test_quiet_zone_is_dropped_before_going_below_one_pixel(self):
+        self.assertEqual(utils.barcode_fit(105, 100, (10, 10)), (1, 2))
+        self.assertEqual(utils.barcode_fit(120, 100, (10, 10)), (1, 10))
+
+    def test_writer_fallback_when_a_module_cannot_get_a_pixel(self):
+        n = len(Code128("ABC-123").build()[0])
+        self.assertIsNone(utils._paint_barcode("ABC-123", (n - 1, 40)))
+        with mock.patch.object(utils, "_writer_barcode", wraps=utils._writer_barcode) as writer:
+            img = utils._draw_barcode("ABC-123", (n - 1, 40))
+        writer.assert_called_once_with("ABC-123", (n - 1, 40))
+        self.assertEqual((img.mode, img.size), ("L", (n - 1, 40)))
+
+class QrTests(SimpleTestCase):
+    def setUp(self):
+        utils.qr_matrix.cache_clear()
+        self.addCleanup(utils.qr_matrix.cache_clear)
+
+    def test_modules_land_on_whole_pixels(self):
+        value, (w, h) = "https://example.com/p/1", (200, 170)
+        matrix = utils.qr_matrix(value, "M")
+        img = utils._paint_qr(value, (w, h))
+        n = len(matrix)
+        scale = min(w, h) // n
+        left, top = (w - n * scale) // 2, (h - n * scale) // 2
+        for r, row in enumerate(matrix):
+            for c, dark in enumerate(row):
+                centre = (left + c * scale + scale // 2, top + r * scale + scale // 2)
+                self.assertEqual(img.getpixel(centre), 0 if dark else 255, (r, c))
+        self.assertEqual(img.getpixel((left - 1, top)), 255)
+
+    def test_too_small_for_one_pixel_per_module(self):
+        n = len(utils.qr_matrix("https://example.com/p/1", "M"))
+        self.assertIsNone(utils._paint_qr("https://example.com/p/1", (n - 1, 200)))
+
+    def test_matrix_is_memoized_per_value_and_level(self):
+        first = utils.qr_matrix("SKU-1", "M")
+        self.assertIs(utils.qr_matrix("SKU-1", "M"), first)
+        self.assertNotEqual(utils.qr_matrix("SKU-1", "H"), first)
+        utils._paint_qr("SKU-1", (100, 100))
+        utils._paint_qr("SKU-1", (300, 300))
+        info = utils.qr_matrix.cache_info()
+        self.assertEqual((info.hits, info.misses), (3, 2))
+
+class RenderModeTests(SimpleTestCase):
+    barcode = {"type": "barcode", "x": 0, "y": 0, "w": 400, "h": 100, "dataKey": "sku"}
+
+    def test_mono_modes_and_size(self):
+        tmpl = _template(self.barcode, {"type": "text", "x": 10, "y": 120, "dataKey": "name", "fontSize": 24})
+        rgb = render_label_to_image(tmpl, {"sku": "ABC-123", "name": "Tea"})
+        self.assertEqual((rgb.mode, rgb.size), ("RGB", (591, 354)))
+        for mode in ("L", "1"):
+            img = render_label_to_image(tmpl, {"sku": "ABC-123", "name": "Tea"}, mode=mode)
+            self.assertEqual((img.mode, img.size), (mode, (591, 354)))
+            self.assertEqual(img.getextrema(), (0, 255))
+
+    def test_transparent_image_areas_keep_what_is_underneath(self):
+        server = _serve_images(self)
+        logo = Image.new("RGBA", (400, 100), (0, 0, 0, 0))
+        logo.paste((255, 255, 255, 255), (200, 0, 400, 100))   # left half clear, right half opaque white
+        out = io.BytesIO()
+        logo.save(out, "PNG")
+        server.body = out.getvalue()
+        image = {"type": "image", "x": 0, "y": 0, "w": 400, "h": 100, "dataKey": "logo"}
+        data = {"sku": "ABC-123", "logo": server.url}
+        for mode in ("L", "1"):
+            bars = render_label_to_image(_template(self.barcode), data, mode=mode)
+            covered = render_label_to_image(_template(self.barcode, image), data, mode=mode)
+            clear, opaque = (20, 10, 180, 90), (220, 10, 380, 90)
+            self.assertEqual(bars.crop(clear).getextrema(), (0, 255))
+            self.assertEqual(covered.crop(clear).tobytes(), bars.crop(clear).tobytes())
+            self.assertEqual(bars.crop(opaque).getextrema(), (0, 255))
+            self.assertEqual(covered.crop(opaque).getextrema(), (255, 255))
+
+    def test_unknown_mode(self):
+        with self.assertRaisesMessage(ValueError, "Unknown render mode 'RGBA'"):
+            render_label_to_image(_template(), {}, mode="RGBA")
+
+class WorkspaceTestCase(TestCase):
+    """A user, an organization with one workspace, and a custom template; MEDIA_ROOT is a temp dir."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("maker@example.com", "pw")
+        cls.org = Organization.objects.create(name="Acme", domain="acme.example", created_by=cls.user)
+        cls.ws = Workspace.objects.create(organization=cls.org, name="Main", slug="main", created_by=cls.user)
+        cls.template = LabelTemplate.objects.create(
+            workspace=cls.ws, name="Shelf", width_mm=30, height_mm=20, dpi=203, created_by=cls.user,
+            schema={"elements": [
+                {"type": "text", "x": 4, "y": 4, "dataKey": "name", "fontSize": 14},
+                {"type": "barcode", "x": 4, "y": 30, "w": 220, "h": 60, "dataKey": "sku"},
+            ]},
+        )
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def login(self, workspace=None):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session["current_workspace_id"] = (workspace or self.ws).id
+        session.save()
+
+    def generate(self, *payloads):
+        result = generate_labels(self.template, self.ws, self.user, enumerate(payloads, start=2), workers=1)
+        self.assertEqual(result.errors, [])
+        return list(LabelInstance.objects.filter(id__in=result.instance_ids).order_by("serial_no"))
+
+class RenderDedupTests(WorkspaceTestCase):
+    def inode(self, inst):
+        return os.stat(os.path.join(settings.MEDIA_ROOT, inst.png_path)).st_ino
+
+    def test_hash_ignores_empty_values_and_key_order(self):
+        self.assertEqual(
+            render_hash(self.template, {"name": "Tea", "sku": "T-1", "note": ""}),
+            render_hash(self.template, {"sku": "T-1", "name": "Tea"}),
+        )
+
+    def test_hash_changes_with_data_and_output_profile(self):
+        data = {"name": "Tea", "sku": "T-1"}
+        plain = render_hash(self.template, data)
+        self.assertNotEqual(plain, render_hash(self.template, dict(data, sku="T-2")))
+        self.assertEqual(plain, render_hash(self.template, data, PROFILES["png"]))
+        self.assertNotEqual(plain, render_hash(self.template, data, PROFILES["png-1bit"]))
+
+    def test_duplicate_rows_share_one_file(self):
+        a, b, c = self.generate({"name": "Tea", "sku": "T-1"}, {"name": "Tea", "sku": "T-1"},
+                               {"name": "Jam", "sku": "J-1"})
+        self.assertEqual(a.render_hash, b.render_hash)
+        self.assertEqual(self.inode(a), self.inode(b))
+        self.assertNotEqual(self.inode(a), self.inode(c))
+
+    def test_reprint_links_the_earlier_file(self):
+        first, = self.generate({"name": "Tea", "sku": "T-1"})
+        again, = self.generate({"name": "Tea", "sku": "T-1"})
+        self.assertNotEqual(first.png_path, again.png_path)
+        self.assertEqual(self.inode(first), self.inode(again))
+
+class SerialCounterTests(WorkspaceTestCase):
+    def test_blocks_are_contiguous_and_disjoint(self):
+        first = SerialCounter.allocate(self.ws.id, 3)
+        second = SerialCounter.allocate(self.ws.id, 2)
+        self.assertEqual(list(first), [1, 2, 3])
+        self.assertEqual(list(second), [4, 5])
+
+    def test_first_block_continues_after_existing_serials(self):
+        LabelInstance.objects.create(workspace=self.ws, template=self.template, serial_no=41, data={})
+        self.assertEqual(list(SerialCounter.allocate(self.ws.id, 2)), [42, 43])
+
+    def test_workspaces_count_separately(self):
+        other = Workspace.objects.create(organization=self.org, name="Other", slug="other")
+        SerialCounter.allocate(self.ws.id, 5)
+        self.assertEqual(list(SerialCounter.allocate(other.id)), [1])
+
+    def test_batch_serials_and_paths_follow_the_block(self):
+        SerialCounter.allocate(self.ws.id, 7)
+        made = LabelInstance.objects.create_batch(self.ws, self.template, self.user, [({}, "")] * 3)
+        self.assertEqual([inst.serial_no for inst in made], [8, 9, 10])
+        self.assertEqual(made[0].png_path, f"labels/{self.ws.id}/instances/serial_8.png")
+
+    def test_single_save_takes_the_next_serial(self):
+        SerialCounter.allocate(self.ws.id, 2)
+        inst = LabelInstance.objects.create(workspace=self.ws, template=self.template, data={})
+        self.assertEqual(inst.serial_no, 3)
+
+class KeysetPageTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        made = LabelInstance.objects.create_batch(self.ws, self.template, self.user, [({}, "")] * 7)
+        # one shared timestamp for the middle rows, so pages have to break ties on id
+        stamp = made[0].created_at
+        LabelInstance.objects.filter(id__in=[m.id for m in made[2:5]]).update(created_at=stamp)
+        self.newest_first = [inst.id for inst in LabelInstance.objects.order_by("-created_at", "-id")]
+        self.qs = LabelInstance.objects.filter(workspace=self.ws)
+
+    def ids(self, page):
+        return [inst.id for inst in page.object_list]
+
+    def test_next_pages_walk_to_the_oldest_row(self):
+        seen, page = [], KeysetPage(self.qs, per_page=3)
+        self.assertFalse(page.has_previous)
+        while True:
+            seen += self.ids(page)
+            if not page.has_next:
+                break
+            page = KeysetPage(self.qs, per_page=3, after=page.next_cursor)
+            self.assertTrue(page.has_previous)
+        self.assertEqual(seen, self.newest_first)
+        self.assertEqual(page.next_cursor, "")
+
+    def test_previous_returns_the_same_page(self):
+        first = KeysetPage(self.qs, per_page=3)
+        second = KeysetPage(self.qs, per_page=3, after=first.next_cursor)
+        back = KeysetPage(self.qs, per_page=3, before=second.previous_cursor)
+        self.assertEqual(self.ids(back), self.ids(first))
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_malformed_cursor_gives_the_first_page(self):
+        page = KeysetPage(self.qs, per_page=3, after="not-a-cursor")
+        self.assertEqual(self.ids(page), self.newest_first[:3])
+
+class SearchTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tea, self.jam, self.mug = LabelInstance.objects.create_batch(self.ws, self.template, self.user, [
+            ({"name": "Green tea", "sku": "SKU-123", "logo": "https://cdn.example/tea.png"}, ""),
+            ({"name": "Berry jam", "sku": "SKU-456", "weight": 250}, ""),
+            ({"name": "Tea mug", "sku": "MUG-9"}, ""),
+        ])
+        self.qs = LabelInstance.objects.filter(workspace=self.ws)
+        if not search._has_fts(self.qs.db):
+            self.skipTest("SQLite built without FTS5")
+
+    def found(self, query):
+        return set(search_instances(self.qs, query))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.found("tea"), {self.tea, self.mug})
+        self.assertEqual(self.found("tea green"), {self.tea})
+
+    def test_last_token_is_a_prefix(self):
+        self.assertEqual(self.found("SKU-12"), {self.tea})
+        self.assertEqual(self.found("sku"), {self.tea, self.jam})
+
+    def test_numbers_are_indexed_and_urls_are_not(self):
+        self.assertEqual(self.found("250"), {self.jam})
+        self.assertEqual(self.found("cdn"), set())
+
+    def test_index_follows_updates_and_deletes(self):
+        LabelInstance.objects.filter(id=self.jam.id).update(data={"name": "Plum jam"})
+        self.assertEqual(self.found("berry"), set())
+        self.assertEqual(self.found("plum"), {self.jam})
+        self.mug.delete()
+        self.assertEqual(self.found("tea"), {self.tea})
+
+    def test_blank_query_returns_everything(self):
+        self.assertEqual(self.found("  "), {self.tea, self.jam, self.mug})
+
+class BaseLayerTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = _serve_images(self)
+        self.logo_template = LabelTemplate.objects.create(
+            workspace=self.ws, name="Logo", width_mm=30, height_mm=20, dpi=203, created_by=self.user,
+            schema={"elements": [
+                {"type": "image", "x": 10, "y": 10, "w": 40, "h": 40, "dataKey": "logo"},
+                {"type": "text", "x": 60, "y": 10, "dataKey": "name", "fontSize": 14},
+            ]},
+        )
+
+    def logo_pixel(self, **kwargs):
+        img = render_label_to_image(self.logo_template, {"logo": self.server.url, "name": "x"}, **kwargs)
+        return img.getpixel((30, 30))
+
+    def test_hoisted_image_follows_a_revalidated_body(self):
+        self.assertEqual(self.logo_pixel(static_keys={"logo"}), (255, 0, 0))
+        self.server.body, self.server.etag = _png("blue"), '"v2"'
+        with mock.patch.object(images, "FRESH_SECONDS", -1):
+            images.fetch(self.server.url)
+        self.assertEqual(self.logo_pixel(static_keys={"logo"}), (0, 0, 255))
+        self.assertEqual(self.logo_pixel(), (0, 0, 255))
+
+    def test_hoisted_placeholder_is_dropped_once_the_url_recovers(self):
+        self.server.down = True
+        self.assertNotEqual(self.logo_pixel(static_keys={"logo"}), (255, 0, 0))
+        self.server.down = False
+        with mock.patch.object(images, "FAILURE_SECONDS", -1):
+            self.assertEqual(self.logo_pixel(static_keys={"logo"}), (255, 0, 0))
+
+class RenderJobTests(WorkspaceTestCase):
+    def enqueue(self, *payloads):
+        return enqueue_job(self.template, self.ws, self.user, enumerate(payloads, start=2))
+
+    def files(self):
+        return [name for _root, _dirs, names in os.walk(settings.MEDIA_ROOT) for name in names]
+
+    def test_job_is_claimed_once(self):
+        first, second = self.enqueue({"sku": "A"}), self.enqueue({"sku": "B"})
+        self.assertEqual(claim_next_job("w1").id, first.id)
+        self.assertEqual(claim_next_job("w2").id, second.id)
+        self.assertIsNone(claim_next_job("w3"))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.worker, first.attempts), (RenderJob.Status.RUNNING, "w1", 1))
+
+    def test_claim_skips_a_candidate_another_worker_won(self):
+        # the conditional UPDATE path (SQLite): the candidate scan is stale by the time we claim
+        taken, free = self.enqueue({"sku": "A"}), self.enqueue({"sku": "B"})
+        RenderJob.objects.filter(id=taken.id).update(status=RenderJob.Status.RUNNING, worker="other")
+        with mock.patch.object(connection.features, "has_select_for_update_skip_locked", False), \
+                mock.patch.object(QuerySet, "values_list", return_value=[taken.id, free.id]):
+            claimed = claim_next_job("w1")
+        self.assertEqual(claimed.id, free.id)
+        taken.refresh_from_db()
+        self.assertEqual(taken.worker, "other")
+
+    def test_stale_jobs_are_requeued_until_max_attempts(self):
+        retry, give_up, alive = self.enqueue({"sku": "A"}), self.enqueue({"sku": "B"}), self.enqueue({"sku": "C"})
+        old = timezone.now() - timedelta(hours=1)
+        RenderJob.objects.filter(id=retry.id).update(status=RenderJob.Status.RUNNING, heartbeat_at=old, attempts=1)
+        RenderJob.objects.filter(id=give_up.id).update(
+            status=RenderJob.Status.RUNNING, heartbeat_at=old, attempts=MAX_ATTEMPTS)
+        RenderJob.objects.filter(id=alive.id).update(status=RenderJob.Status.RUNNING, heartbeat_at=timezone.now())
+        self.assertEqual(requeue_stale_jobs(), 2)
+        statuses = dict(RenderJob.objects.values_list("id", "status"))
+        self.assertEqual(statuses, {retry.id: RenderJob.Status.QUEUED, give_up.id: RenderJob.Status.FAILED,
+                                    alive.id: RenderJob.Status.RUNNING})
+
+    def test_resumed_job_starts_after_processed_rows(self):
+        job = self.enqueue({"name": "one", "sku": "A"}, {"name": "two", "sku": "B"}, {"name": "three", "sku": "C"})
+        done, = self.generate({"name": "one", "sku": "A"})
+        RenderJob.objects.filter(id=job.id).update(processed=1, instance_ids=[done.id])
+        self.assertTrue(run_job(claim_next_job("w1"), workers=1))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (RenderJob.Status.DONE, 3))
+        names = [i.data["name"] for i in LabelInstance.objects.filter(id__in=job.instance_ids).order_by("serial_no")]
+        self.assertEqual(names, ["one", "two", "three"])
+
+    def test_worker_that_lost_its_claim_rolls_back(self):
+        job = self.enqueue({"name": "one", "sku": "A"}, {"name": "two", "sku": "B"})
+        claimed = claim_next_job("w1")
+        RenderJob.objects.filter(id=job.id).update(worker="w2")   # requeued and picked up elsewhere
+        self.assertFalse(run_job(claimed, workers=1))
+        self.assertFalse(LabelInstance.objects.exists())
+        self.assertEqual(self.files(), [])
+        job.refresh_from_db()
+        # left to the new owner: not marked failed by the worker that lost it
+        self.assertEqual((job.status, job.worker, job.processed, job.error), (RenderJob.Status.RUNNING, "w2", 0, ""))
+
+    def test_status_and_detail_are_scoped_to_the_workspace(self):
+        job = self.enqueue({"sku": "A"})
+        other = Workspace.objects.create(organization=self.org, name="Other", slug="other")
+        self.login()
+        status = self.client.get(reverse("labels:job_status", args=[job.id]))
+        self.assertEqual((status.status_code, status.json()["total"]), (200, 1))
+        self.assertEqual(self.client.get(reverse("labels:job_detail", args=[job.id])).status_code, 200)
+        self.login(other)
+        self.assertEqual(self.client.get(reverse("labels:job_status", args=[job.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("labels:job_detail", args=[job.id])).status_code, 404)
+
+class LabelZipTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.labels = self.generate(*({"name": f"Item {i}", "sku": f"Z-{i}"} for i in range(4)))
+        self.login()
+
+    def download(self, **params):
+        response = self.client.get(reverse("labels:history_zip"), params)
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def manifest(self, archive):
+        return list(csv.DictReader(io.StringIO(archive.read("manifest.csv").decode("utf-8"))))
+
+    def test_archive_holds_every_label_and_a_manifest(self):
+        archive = self.download()
+        files = [f"shelf/{inst.serial_no}.png" for inst in self.labels]
+        self.assertEqual(archive.namelist(), files + ["manifest.csv"])
+        with open(os.path.join(settings.MEDIA_ROOT, self.labels[0].png_path), "rb") as fh:
+            self.assertEqual(archive.read(files[0]), fh.read())
+        rows = self.manifest(archive)
+        self.assertEqual([row["file"] for row in rows], files)
+        self.assertEqual(json.loads(rows[1]["data"]), {"name": "Item 1", "sku": "Z-1"})
+
+    def test_missing_file_is_listed_without_a_file(self):
+        os.remove(os.path.join(settings.MEDIA_ROOT, self.labels[1].png_path))
+        archive = self.download()
+        self.assertNotIn(f"shelf/{self.labels[1].serial_no}.png", archive.namelist())
+        rows = {row["serial_no"]: row for row in self.manifest(archive)}
+        self.assertEqual(rows[str(self.labels[1].serial_no)]["file"], "")
+
+    def test_filters(self):
+        first, second, third, fourth = self.labels
+        other = LabelTemplate.objects.create(workspace=self.ws, name="Other", schema={}, created_by=self.user)
+        LabelInstance.objects.filter(id=fourth.id).update(template=other)
+        LabelInstance.objects.filter(id=first.id).update(created_at=timezone.now() - timedelta(days=10))
+
+        def serials(**params):
+            return [row["serial_no"] for row in self.manifest(self.download(**params))]
+
+        self.assertEqual(serials(template=other.id), [str(fourth.serial_no)])
+        self.assertEqual(serials(serial_from=second.serial_no, serial_to=third.serial_no),
+                         [str(second.serial_no), str(third.serial_no)])
+        since = (timezone.now() - timedelta(days=2)).date().isoformat()
+        self.assertNotIn(str(first.serial_no), serials(date_from=since))
+        self.assertEqual(serials(date_to=since), [str(first.serial_no)])
+
+    def test_other_workspaces_are_excluded(self):
+        other = Workspace.objects.create(organization=self.org, name="Other", slug="other")
+        LabelInstance.objects.create_batch(other, self.template, self.user, [({"name": "theirs"}, "")])
+        self.assertEqual(len(self.manifest(self.download())), 4)
+        self.login(other)
+        self.assertEqual([row["data"] for row in self.manifest(self.download())], ['{"name": "theirs"}'])
+
+def _pdf_objects(data):
+    """
+    {object id: (dictionary line, stream bytes or None)} of a PDF written by
+    labels.pdf, checking that every xref offset lands on its "N 0 obj" header.
+    """
+    assert data.startswith(b"%PDF-1.4\n") and data.endswith(b"%%EOF\n")
+    xref = int(data[data.rindex(b"startxref") + 9:].split()[0])
+    lines = data[xref:].split(b"\n")
+    assert lines[0] == b"xref"
+    size = int(lines[1].split()[1])
+    objects = {}
+    for oid in range(1, size):
+        start = int(lines[2 + oid][:10])
+        header = f"{oid} 0 obj\n".encode()
+        assert data.startswith(header, start), f"xref offset of object {oid} is off"
+        start += len(header)
+        end = data.index(b"\n", start)
+        body, stream = data[start:end].decode("latin-1"), None
+        if data.startswith(b"stream\n", end + 1):
+            length = int(re.search(r"/Length (\d+)", body).group(1))
+            stream = data[end + 8:end + 8 + length]
+            assert data.startswith(b"\nendstream\nendobj\n", end + 8 + length)
+        objects[oid] = (body, stream)
+    return objects
+
+class SheetPdfTests(WorkspaceTestCase):
+    def impose(self, layout, *payloads, output=None):
+        result = generate_labels(self.template, self.ws, self.user, enumerate(payloads, start=2), workers=1,
+                                 sheet_layout=layout, output=output)
+        self.assertEqual(result.errors, [])
+        with open(os.path.join(settings.MEDIA_ROOT, result.pdf_path), "rb") as fh:
+            objects = _pdf_objects(fh.read())
+        return result, objects
+
+    def of_type(self, objects, kind):
+        return [body for body, _stream in objects.values() if kind in body]
+
+    def rows(self, n):
+        return [{"name": f"Item {i}", "sku": f"P-{i}"} for i in range(n)]
+
+    def test_pages_for_n_labels_on_a4(self):
+        _result, objects = self.impose(SheetLayout("A4", columns=2, rows=2), *self.rows(5))
+        pages = self.of_type(objects, "/Type /Page ")
+        self.assertEqual(len(pages), 2)
+        self.assertIn("/MediaBox [0 0 595.28 841.89]", pages[0])
+        self.assertIn("/Count 2", self.of_type(objects, "/Type /Pages")[0])
+        contents = [stream for body, stream in objects.values() if stream and "/Subtype" not in body]
+        self.assertEqual([c.count(b" Do Q") for c in contents], [4, 1])
+
+    def test_roll_pages_hold_one_row(self):
+        _result, objects = self.impose(SheetLayout("ROLL", columns=2), *self.rows(5))
+        pages = self.of_type(objects, "/Type /Page ")
+        self.assertEqual(len(pages), 3)
+        # 2 x 30 mm labels + 2 mm gap + 10 mm margins = 82 x 40 mm
+        self.assertIn(f"/MediaBox [0 0 {82 * PT_PER_MM:.2f} {40 * PT_PER_MM:.2f}]", pages[0])
+
+    def test_grid_rejects_what_does_not_fit(self):
+        with self.assertRaises(ValueError):
+            SheetLayout("A4", columns=7).grid(30, 20)
+        with self.assertRaises(ValueError):
+            SheetLayout("A4").grid(300, 20)
+        with self.assertRaises(ValueError):
+            SheetLayout("A3").grid(30, 20)
+
+    def test_labels_sharing_a_render_hash_share_one_image(self):
+        _result, objects = self.impose(SheetLayout("A4"), *(self.rows(2) * 3))
+        images = [(body, stream) for body, stream in objects.values() if "/Subtype /Image" in body]
+        self.assertEqual(len(images), 2)
+        body, stream = images[0]
+        # embedded as the PNG's own IDAT stream: one filter byte per row before the pixels
+        width, height = (int(re.search(rf"/{k} (\d+)", body).group(1)) for k in ("Width", "Height"))
+        self.assertIn("/Predictor 15", body)
+        self.assertEqual(len(zlib.decompress(stream)), height * (1 + 3 * width))
+
+    def test_non_png_files_go_through_pillow(self):
+        result, objects = self.impose(SheetLayout("A4"), *self.rows(1), output="tiff-g4")
+        body, stream = next((b, s) for b, s in objects.values() if "/Subtype /Image" in b)
+        self.assertNotIn("/DecodeParms", body)
+        self.assertIn("/ColorSpace /DeviceGray", body)
+        inst = LabelInstance.objects.get(id=result.instance_ids[0])
+        with Image.open(os.path.join(settings.MEDIA_ROOT, inst.png_path)) as im:
+            self.assertEqual(zlib.decompress(stream), im.convert("L").tobytes())
+
+    def test_pdf_path_is_recorded_on_the_instances(self):
+        result, _objects = self.impose(SheetLayout("A4"), *self.rows(3))
+        self.assertTrue(result.pdf_path.startswith(f"labels/{self.ws.id}/sheets/"))
+        self.assertEqual(set(LabelInstance.objects.values_list("pdf_path", flat=True)), {result.pdf_path})
+
+SVG = "{http://www.w3.org/2000/svg}"
+
+class VectorTests(SimpleTestCase):
+    barcode = {"type": "barcode", "x": 10, "y": 10, "w": 400, "h": 100, "dataKey": "sku"}
+    qrcode = {"type": "qrcode", "x": 10, "y": 150, "w": 150, "h": 150, "dataKey": "url"}
+    text = {"type": "text", "x": 10, "y": 320, "dataKey": "name", "fontSize": 20}
+    data = {"sku": "ABC-123", "url": "https://example.com/p/1", "name": "a<b & (c) \\d"}
+
+    def svg(self):
+        root = ElementTree.fromstring(render_label_to_svg(_template(self.barcode, self.qrcode, self.text), self.data))
+        paths = [p.get("d") for p in root.iter(f"{SVG}path")]
+        return root, [d.count("M") for d in paths]
+
+    def test_svg_is_sized_and_parses(self):
+        root, _rects = self.svg()
+        self.assertEqual((root.get("width"), root.get("height")), ("50mm", "30mm"))
+        self.assertEqual(root.get("viewBox"), "0 0 591 354")
+
+    def test_svg_draws_one_rect_per_bar_and_qr_run(self):
+        _root, rects = self.svg()
+        bars = len(list(bar_runs(barcode_modules(self.data["sku"])[0])))
+        qr_runs = sum(len(re.findall(r"1+", "".join("1" if m else "0" for m in row)))
+                      for row in qr_matrix(self.data["url"], qr_error_level()))
+        self.assertEqual(rects, [bars, qr_runs])
+
+    def test_svg_escapes_text(self):
+        root, _rects = self.svg()
+        texts = [t.text for t in root.iter(f"{SVG}text")]
+        self.assertIn(self.data["name"], texts)
+        self.assertIn("ABC-123", texts)
+
+    def test_pdf_page_and_escaped_text(self):
+        objects = _pdf_objects(render_label_to_pdf(_template(self.barcode, self.qrcode, self.text), self.data))
+        page = next(body for body, _stream in objects.values() if "/Type /Page " in body)
+        self.assertIn(f"/MediaBox [0 0 {50 * PT_PER_MM:.2f} {30 * PT_PER_MM:.2f}]", page)
+        content = zlib.decompress(next(s for b, s in objects.values() if s and "/Subtype" not in b))
+        self.assertIn(b"(a<b & \\(c\\) \\\\d) Tj", content)
+        self.assertEqual(content.count(b" re\n"), sum(self.svg()[1]))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            render_label_vector(_template(), {}, "eps")
+
+class LabelExportTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.label = self.generate({"name": "Tea", "sku": "T-1"})[0]
+        self.login()
+
+    def export(self, inst, fmt):
+        return self.client.get(reverse("labels:label_export", args=[inst.id, fmt]))
+
+    def test_svg_and_pdf(self):
+        svg = self.export(self.label, "svg")
+        self.assertEqual(svg["Content-Type"], "image/svg+xml")
+        self.assertIn(f'filename="shelf_{self.label.serial_no}.svg"', svg["Content-Disposition"])
+        ElementTree.fromstring(svg.content)
+        self.assertTrue(self.export(self.label, "pdf").content.startswith(b"%PDF-"))
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.export(self.label, "eps").status_code, 400)
+
+    def test_other_workspace_instance_is_not_found(self):
+        other = Workspace.objects.create(organization=self.org, name="Other", slug="other")
+        theirs = LabelInstance.objects.create_batch(other, self.template, self.user, [({"name": "x"}, "")])[0]
+        self.assertEqual(self.export(theirs, "svg").status_code, 404)
+
+class BulkCsvTests(WorkspaceTestCase):
+    def rows(self, text):
+        return list(read_csv_rows(self.template, io.BytesIO(text.encode("utf-8"))))
+
+    def test_header_must_share_a_column_with_the_template(self):
+        with self.assertRaisesMessage(ValueError, "CSV header does not match this template"):
+            self.rows("colour,size\nred,XL\n")
+
+    def test_blank_rows_are_skipped_and_rows_keep_their_line_numbers(self):
+        rows = self.rows("name,sku\nTea,T-1\n,,\n\n , \nCoffee,C-1\n")
+        self.assertEqual([(line, payload["name"], payload["sku"]) for line, payload in rows],
+                         [(2, "Tea", "T-1"), (6, "Coffee", "C-1")])
+
+    def test_a_failing_row_is_reported_and_the_others_are_created(self):
+        def render(template, payload, *args):
+            if payload["name"] == "bad":
+                raise ValueError("cannot draw")
+            return render_label_to_image(template, payload, *args)
+
+        rows = self.rows("name,sku\nTea,T-1\nbad,B-1\nCoffee,C-1\n")
+        with mock.patch("labels.bulk.render_label_to_image", side_effect=render):
+            result = generate_labels(self.template, self.ws, self.user, rows, workers=1)
+        self.assertEqual(result.errors, [RowError(3, "cannot draw")])
+        self.assertEqual(result.created, 2)
+        names = LabelInstance.objects.filter(id__in=result.instance_ids).values_list("data__name", flat=True)
+        self.assertEqual(sorted(names), ["Coffee", "Tea"])
+
+    def test_templates_of_other_workspaces_are_not_found(self):
+        other = Workspace.objects.create(organization=self.org, name="Other", slug="other")
+        theirs = LabelTemplate.objects.create(workspace=other, name="Theirs", schema={}, created_by=self.user)
+        self.login()
+        self.assertEqual(self.client.get(reverse("labels:generate_bulk", args=[theirs.id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("labels:generate_bulk", args=[self.template.id])).status_code, 200)
+
+class TimingTests(WorkspaceTestCase):
+    def setUp(self):
+        super().setUp()
+        timing.reset()
+        self.addCleanup(timing.reset)
+
+    def render_count(self):
+        return timing.snapshot()["stages"].get("render", {}).get("count", 0)
+
+    @override_settings(LABELS_RENDER_TIMING=False)
+    def test_disabled_spans_are_one_shared_no_op(self):
+        self.assertIs(timing.span("render"), timing.span("barcode.encode"))
+        with timing.collect() as totals, timing.span("render"):
+            pass
+        self.assertEqual(totals, {})
+        self.assertEqual(timing.snapshot()["stages"], {})
+
+    @override_settings(LABELS_RENDER_TIMING=True)
+    def test_collect_totals_become_a_server_timing_header(self):
+        self.login()
+        response = self.client.post(reverse("labels:generate_single", args=[self.template.id]),
+                                    {"name": "Tea", "sku": "T-1"})
+        self.assertEqual(response.status_code, 200)
+        stages = dict(part.split(";", 1) for part in response["Server-Timing"].split(", "))
+        self.assertIn("render", stages)
+        self.assertIn("barcode.encode", stages)
+        self.assertEqual(self.render_count(), 1)
+
+    @override_settings(LABELS_RENDER_TIMING=True)
+    def test_pooled_renders_reach_the_parent_histograms(self):
+        rows = enumerate(({"name": f"Item {i}", "sku": f"P-{i}"} for i in range(6)), start=2)
+        with timing.collect() as totals:
+            result = generate_labels(self.template, self.ws, self.user, rows, workers=2)
+        self.assertEqual(result.created, 6)
+        self.assertEqual(self.render_count(), 6)
+        self.assertEqual(totals["render"][1], 6)
+
+    def test_render_timings_are_for_staff_only(self):
+        self.login()
+        self.assertEqual(self.client.get(reverse("labels:render_timings")).status_code, 403)
+        get_user_model().objects.filter(id=self.user.id).update(is_staff=True)
+        response = self.client.get(reverse("labels:render_timings"))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ok"])
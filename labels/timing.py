@@ -0,0 +1,160 @@
+"""
+Render stage timing.
+
+    with timing.span("barcode.encode"):
+        ...
+
+Spans are off unless settings.LABELS_RENDER_TIMING is true; span() then hands
+back a shared no-op context manager, so instrumented code costs one call per
+stage. When on, every span
+  * adds its duration to a histogram kept per process (snapshot(), served as
+    JSON to staff by labels:render_timings), and
+  * adds to the totals of the surrounding collect() block, which generate
+    views turn into a Server-Timing response header.
+
+Spans in bulk pool children are captured there and replayed in the parent, so
+pooled renders show up in the parent's histograms and collect() totals too.
+"""
+import bisect, contextvars, os, threading, time
+from contextlib import contextmanager, nullcontext
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# histogram bucket upper bounds, milliseconds (the last bucket is open-ended)
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_NOOP = nullcontext()
+_enabled = None
+_lock = threading.Lock()
+_histograms = {}
+_since = time.time()
+_current = contextvars.ContextVar("labels_timing_totals", default=None)
+_captured = contextvars.ContextVar("labels_timing_samples", default=None)
+
+def enabled():
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(getattr(settings, "LABELS_RENDER_TIMING", False))
+    return _enabled
+
+@receiver(setting_changed)
+def _setting_changed(setting, **kwargs):
+    global _enabled
+    if setting == "LABELS_RENDER_TIMING":
+        _enabled = None
+
+class _Histogram:
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th sample (capped at the observed max)."""
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "min_ms": round(self.min, 3) if self.count else 0.0,
+            "max_ms": round(self.max, 3),
+            "p50_ms": round(self.quantile(0.50), 3),
+            "p90_ms": round(self.quantile(0.90), 3),
+            "p99_ms": round(self.quantile(0.99), 3),
+            "buckets": [[le, n] for le, n in zip(list(BUCKETS_MS) + [None], self.counts) if n],
+        }
+
+def record(name, ms):
+    """Add one `ms` sample for stage `name` (what span() does on exit)."""
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = _Histogram()
+        hist.add(ms)
+    totals = _current.get()
+    if totals is not None:
+        dur, n = totals.get(name, (0.0, 0))
+        totals[name] = (dur + ms, n + 1)
+    samples = _captured.get()
+    if samples is not None:
+        samples.append((name, ms))
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+def span(name):
+    """Context manager timing one stage; a shared no-op while timing is disabled."""
+    return _Span(name) if (_enabled if _enabled is not None else enabled()) else _NOOP
+
+@contextmanager
+def collect():
+    """Gather {stage: (total ms, count)} of the spans run inside the block (this thread/task only)."""
+    totals = {}
+    token = _current.set(totals)
+    try:
+        yield totals
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def capture():
+    """Gather the raw [(stage, ms)] samples of the block, to hand them to another process."""
+    samples = []
+    token = _captured.set(samples)
+    try:
+        yield samples
+    finally:
+        _captured.reset(token)
+
+def replay(samples):
+    """record() samples captured in another process (a bulk pool child) here."""
+    for name, ms in samples:
+        record(name, ms)
+
+def server_timing(totals):
+    """Server-Timing header value for collect() totals, slowest stage first."""
+    parts = sorted(totals.items(), key=lambda kv: -kv[1][0])
+    return ", ".join(
+        f'{name};dur={dur:.2f}' + (f';desc="x{n}"' if n > 1 else "") for name, (dur, n) in parts
+    )
+
+def snapshot():
+    with _lock:
+        stages = {name: hist.as_dict() for name, hist in sorted(_histograms.items())}
+    return {"pid": os.getpid(), "enabled": enabled(), "since": _since, "stages": stages}
+
+def reset():
+    global _since
+    with _lock:
+        _histograms.clear()
+        _since = time.time()
@@ -13,5 +13,11 @@ urlpatterns = [
     path("templates/<int:pk>/csv/", views.template_csv, name="template_csv"),
     path("generate/", views.generate_choose_template, name="generate_choose"),
     path("generate/<int:pk>/single/", views.generate_single, name="generate_single"),
+    path("generate/<int:pk>/bulk/", views.generate_bulk, name="generate_bulk"),
     path("history/", views.history, name="history"),
+    path("history/zip/", views.history_zip, name="history_zip"),
+    path("jobs/<int:pk>/", views.job_detail, name="job_detail"),
+    path("jobs/<int:pk>/status/", views.job_status_view, name="job_status"),
+    path("instances/<int:pk>/label.<str:fmt>", views.label_export, name="label_export"),
+    path("timings/", views.render_timings, name="render_timings"),
 ]
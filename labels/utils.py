@@ -1,31 +1,175 @@
 import io, os
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 import qrcode
 from barcode import Code128, EAN13
 from barcode.writer import ImageWriter
-import requests
 from django.conf import settings
+from .plans import mm2px, get_render_plan, plan_cache_key, split_static
+from .cache import LRUCache, image_nbytes
+from .images import fetch, load_image, ImageFetchError, prefetch, image_urls
+from .timing import span
 
-def mm2px(mm, dpi): return round(mm * dpi / 25.4)
+# ---- fonts -----------------------------------------------------------------
+# Parsing a .ttf is far more expensive than drawing with it, so font objects
+# are shared process-wide (renderer, bulk workers) behind a bounded LRU.
+
+FONT_DIR = os.path.join(settings.BASE_DIR, "static", "fonts")
+DEFAULT_FONT_FILE = "DejaVuSans.ttf"
+FONT_CACHE_SIZE = 128
+
+@lru_cache(maxsize=64)
+def resolve_font_path(family=None):
+    """Map an element's fontFamily ("DejaVu Sans", "DejaVuSans.ttf") to a file in FONT_DIR."""
+    family = os.path.basename((family or "").strip())  # schema is user input: stay inside FONT_DIR
+    if family:
+        if family.lower().endswith((".ttf", ".otf")):
+            names = [family]
+        else:
+            names = [base + ext for base in (family, family.replace(" ", "")) for ext in (".ttf", ".otf")]
+        for name in names:
+            path = os.path.join(FONT_DIR, name)
+            if os.path.isfile(path):
+                return path
+    return os.path.join(FONT_DIR, DEFAULT_FONT_FILE)
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font_path, size):
+    """Return a (cached) font for (path, size); Pillow default if truetype not found."""
+    try:
+        return ImageFont.truetype(font_path, size)
+    except Exception:
+        return ImageFont.load_default()
+
+def font_for(family, size):
+    return get_font(resolve_font_path(family), int(size))
 
 def _load_image_from_url(url, target_size=None):
     try:
-        r = requests.get(url, timeout=5)
-        r.raise_for_status()
-        img = Image.open(io.BytesIO(r.content)).convert("RGBA")
-        if target_size:
-            img = img.resize(target_size, Image.LANCZOS)
-        return img
+        if not url:
+            raise ImageFetchError("no url")
+        return load_image(url, target_size)
+    except ImageFetchError:
+        return _placeholder_image(tuple(target_size or (120, 80)))
+
+@lru_cache(maxsize=64)
+def _placeholder_image(size):
+    # fallback placeholder (shared: callers only composite it)
+    w, h = size
+    ph = Image.new("RGBA", (w, h), (240,240,240,255))
+    d = ImageDraw.Draw(ph)
+    d.rectangle([(0,0),(w-1,h-1)], outline=(180,180,180,255))
+    d.text((6,6), "IMG", fill=(120,120,120,255))
+    return ph
+
+# ---- barcodes --------------------------------------------------------------
+# The native path asks python-barcode only for the module pattern and paints
+# the bars at the target size, each module a whole number of pixels wide.
+# The "writer" path (ImageWriter -> PNG -> resize) stays as the fallback and
+# can be forced with settings.LABELS_BARCODE_RENDERER = "writer" (which also
+# switches QR codes back to the make_image + resize path).
+#
+# Finished code bitmaps are opaque "L" images memoized in a byte-bounded LRU
+# keyed by (symbology, value, w, h, options): reprints of a SKU, across
+# templates and days, paste a cached bitmap instead of encoding again.
+
+CODE_CACHE_BYTES = 64 * 1024 * 1024
+_code_rasters = LRUCache(max_bytes=CODE_CACHE_BYTES, sizeof=image_nbytes)
+
+def code_cache_stats():
+    return _code_rasters.stats()
+
+# Quiet zone reserved inside the element box, in modules (left, right): scanners
+# need 10X each side for Code 128 (ISO/IEC 15417) and 11X / 7X for EAN-13, or a
+# neighbouring element reads as bars. settings.LABELS_BARCODE_QUIET_MODULES
+# overrides both sides for every symbology.
+BARCODE_QUIET_ZONES = {"code128": (10, 10), "ean13": (11, 7)}
+
+def barcode_quiet_override():
+    return getattr(settings, "LABELS_BARCODE_QUIET_MODULES", None)
+
+def barcode_quiet_zone(symbology):
+    n = barcode_quiet_override()
+    return (n, n) if n is not None else BARCODE_QUIET_ZONES[symbology]
+
+def barcode_fit(width, n_modules, quiet, whole=True):
+    """
+    (module width, offset of the first bar) centring the symbol plus its quiet zone
+    in `width`. With whole=True modules are whole pixels, and the quiet zone is
+    dropped when keeping it would leave less than 1 px per module.
+    """
+    left_q, right_q = quiet
+    total = n_modules + left_q + right_q
+    if not whole:
+        module = width / total
+        return module, (width - module * total) / 2 + left_q * module
+    module = width // total
+    if module < 1:
+        module, left_q, total = width // n_modules, 0, n_modules
+    return module, (width - module * total) // 2 + left_q * module
+
+def barcode_renderer():
+    return getattr(settings, "LABELS_BARCODE_RENDERER", "native")
+
+def barcode_modules(value):
+    """
+    Return (module pattern, human-readable text, (left, right) quiet modules);
+    same Code128 -> EAN13 fallback as the writer path.
+    """
+    try:
+        return Code128(value).build()[0], value, barcode_quiet_zone("code128")
+    except Exception:
+        padded = (value if value.isdigit() else "0000000000000")[:13].ljust(13, "0")
+        ean = EAN13(padded)
+        return ean.build()[0], ean.get_fullcode(), barcode_quiet_zone("ean13")
+
+def bar_runs(pattern):
+    """Yield (start_module, width_in_modules) for each dark bar."""
+    start = None
+    for i, m in enumerate(pattern + "0"):
+        dark = m != "0"   # EAN guard bars may come back as "G"
+        if dark and start is None:
+            start = i
+        elif not dark and start is not None:
+            yield start, i - start
+            start = None
+
+def _paint_barcode(value, size_px):
+    """Bars for `value` as an "L" image of size_px, or None if they can't fit at 1 px/module."""
+    w, h = size_px
+    try:
+        pattern, text, quiet = barcode_modules(value)
     except Exception:
-        # fallback placeholder
-        w, h = target_size or (120, 80)
-        ph = Image.new("RGBA", (w, h), (240,240,240,255))
-        d = ImageDraw.Draw(ph)
-        d.rectangle([(0,0),(w-1,h-1)], outline=(180,180,180,255))
-        d.text((6,6), "IMG", fill=(120,120,120,255))
-        return ph
+        return None
+    module, left = barcode_fit(w, len(pattern), quiet)
+    if module < 1:
+        return None
+
+    text_h = h // 5 if h >= 40 else 0
+    bar_h = h - text_h
+    img = Image.new("L", (w, h), 255)
+    draw = ImageDraw.Draw(img)
+    for start, run in bar_runs(pattern):
+        draw.rectangle([left + start * module, 0, left + (start + run) * module - 1, bar_h - 1], fill=0)
+    if text_h:
+        font = font_for(None, max(6, text_h - 2))
+        tw = draw.textlength(text, font=font)
+        draw.text(((w - tw) / 2, bar_h), text, fill=0, font=font)
+    return img
 
 def _draw_barcode(value, size_px):
+    """Opaque "L" barcode bitmap for value at size_px (memoized; don't modify it)."""
+    renderer = barcode_renderer()
+    key = ("barcode", value, size_px[0], size_px[1], (renderer, barcode_quiet_override()))
+    img = _code_rasters.get(key)
+    if img is None:
+        img = _paint_barcode(value, size_px) if renderer == "native" else None
+        if img is None:
+            img = _writer_barcode(value, size_px).convert("L")
+        _code_rasters.set(key, img)
+    return img
+
+def _writer_barcode(value, size_px):
     # try Code128 first (generic)
     try:
         barcode = Code128(value, writer=ImageWriter())
@@ -46,57 +190,206 @@ def _draw_barcode(value, size_px):
     img = Image.open(out).convert("RGBA")
     return img.resize(size_px, Image.LANCZOS)
 
+# ---- QR codes --------------------------------------------------------------
+# Same idea as barcodes: take the module matrix from qrcode and paint it at the
+# largest whole-pixel scale that fits the element box. Matrices are memoized,
+# so reprinting a SKU skips the Reed-Solomon encode.
+
+QR_ERROR_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
+
+def qr_error_level():
+    return getattr(settings, "LABELS_QR_ERROR_CORRECTION", "M")
+
+@lru_cache(maxsize=4096)
+def qr_matrix(value, level="M"):
+    """Module matrix (border included) as a tuple of row tuples of bools."""
+    qr = qrcode.QRCode(border=1, error_correction=QR_ERROR_LEVELS.get(level, qrcode.constants.ERROR_CORRECT_M))
+    qr.add_data(value)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+def _paint_qr(value, size_px):
+    """QR modules for `value` as an "L" image of size_px, or None if it doesn't fit at 1 px/module."""
+    w, h = size_px
+    try:
+        matrix = qr_matrix(value, qr_error_level())
+    except Exception:
+        return None
+    n = len(matrix)
+    scale = min(w, h) // n
+    if scale < 1:
+        return None
+    left = (w - n * scale) // 2
+    top = (h - n * scale) // 2
+    img = Image.new("L", (w, h), 255)
+    draw = ImageDraw.Draw(img)
+    for r, row in enumerate(matrix):
+        row_y = top + r * scale
+        c = 0
+        while c < n:
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < n and row[c]:
+                c += 1
+            draw.rectangle([left + start * scale, row_y, left + c * scale - 1, row_y + scale - 1], fill=0)
+    return img
+
 def _draw_qr(value, size_px):
+    """Opaque "L" QR bitmap for value at size_px (memoized; don't modify it)."""
+    renderer, level = barcode_renderer(), qr_error_level()
+    key = ("qrcode", value, size_px[0], size_px[1], (renderer, level))
+    img = _code_rasters.get(key)
+    if img is None:
+        img = _paint_qr(value, size_px) if renderer == "native" else None
+        if img is None:
+            img = _writer_qr(value, size_px).convert("L")
+        _code_rasters.set(key, img)
+    return img
+
+def _writer_qr(value, size_px):
     qr = qrcode.QRCode(box_size=10, border=1)
     qr.add_data(value)
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white").convert("RGBA")
     return img.resize(size_px, Image.LANCZOS)
 
-def render_label_to_image(template, data: dict):
-    """Return a PIL Image using template.schema and data keys."""
-    W = mm2px(template.width_mm, template.dpi)
-    H = mm2px(template.height_mm, template.dpi)
-    img = Image.new("RGBA", (W, H), "white")
-    draw = ImageDraw.Draw(img)
+# ---- drawing ---------------------------------------------------------------
+# Colour labels are drawn on an RGBA canvas. Monochrome ones (for black-and-white
+# thermal printers) are drawn straight into an "L" or "1" canvas: text and code
+# bitmaps are black and white already, so only image elements need reducing,
+# and on a "1" canvas they are the only thing that gets dithered.
+
+RENDER_MODES = ("RGB", "L", "1")
+
+def _canvas(size, mode):
+    """Blank white canvas to draw a label of `mode` ("RGB" draws on RGBA) into."""
+    return Image.new("RGBA", size, "white") if mode == "RGB" else Image.new(mode, size, 255 if mode == "L" else 1)
+
+def _mono(bitmap, mode):
+    """An "L" code bitmap in the canvas mode; "1" is a hard threshold so bars keep their edges."""
+    return bitmap.convert("1", dither=Image.Dither.NONE) if mode == "1" else bitmap
+
+def _mono_image(thumb, mode):
+    """
+    (image, mask) for pasting an RGBA image element into an "L"/"1" canvas: the
+    gray pixels (Floyd-Steinberg dithered for "1") and its alpha, thresholded for
+    "1", so transparent areas leave what is already drawn underneath.
+    """
+    gray = Image.new("L", thumb.size, 255)
+    alpha = thumb.getchannel("A")
+    gray.paste(thumb.convert("L"), mask=alpha)
+    if mode != "1":
+        return gray, alpha
+    return gray.convert("1"), alpha.point(lambda a: 255 if a >= 128 else 0, "1")
 
-    # load a basic font; Pillow default if truetype not found
+def _draw_op(img, draw, op, data):
+    x, y, w, h = op.x, op.y, op.w, op.h
+    val = op.resolve(data)
+    mono = img.mode != "RGBA"
+
+    if op.kind == "text":
+        with span("text.font"):
+            font = font_for(op.font_family, op.font_size)
+        with span("text.draw"):
+            draw.text((x, y), val, fill=0 if mono else (0,0,0), font=font)
+
+    elif op.kind == "image":
+        with span("image.fetch"):
+            thumb = _load_image_from_url(val, (w, h)) if val else _load_image_from_url("", (w, h))
+        with span("image.composite"):
+            if mono:
+                pixels, mask = _mono_image(thumb, img.mode)
+                img.paste(pixels, (x, y), mask)
+            else:
+                img.alpha_composite(thumb, (x, y))
+
+    elif op.kind == "barcode":
+        with span("barcode.encode"):
+            bars = _draw_barcode(val, (w, h))
+        with span("barcode.paste"):
+            img.paste(_mono(bars, img.mode), (x, y))   # opaque, so paste == alpha_composite
+
+    elif op.kind == "qrcode":
+        with span("qrcode.encode"):
+            modules = _draw_qr(val, (w, h))
+        with span("qrcode.paste"):
+            img.paste(_mono(modules, img.mode), (x, y))
+
+# ---- static base layers ----------------------------------------------------
+# Elements that read no row data (or only keys the caller says are constant for
+# the run, e.g. logo/company columns in a bulk CSV) are rasterised once per
+# template version (and render mode) into a base layer; each label starts from a copy.
+
+BASE_LAYER_CACHE_BYTES = 256 * 1024 * 1024
+_base_layers = LRUCache(max_items=64, max_bytes=BASE_LAYER_CACHE_BYTES, sizeof=image_nbytes)
+
+def _image_version(url):
+    """What an image element will paint for `url`: its current body's sha256, or "" for the placeholder."""
     try:
-        font_path = os.path.join(settings.BASE_DIR, "static", "fonts", "DejaVuSans.ttf")
-        default_font = ImageFont.truetype(font_path, 12)
-    except Exception:
-        default_font = ImageFont.load_default()
-
-    elements = (template.schema or {}).get("elements", [])
-    for el in elements:
-        x, y = int(el.get("x",0)), int(el.get("y",0))
-        w, h = int(el.get("w",80)), int(el.get("h",20))
-        t = el.get("type")
-        key = (el.get("dataKey") or "").strip()
-        font_size = int(el.get("fontSize") or 12)
-        font = default_font
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-        except Exception:
-            pass
+        return fetch(url) if url else ""
+    except ImageFetchError:
+        return ""
 
-        if t == "text":
-            val = data.get(key) or el.get("value") or ""
-            draw.text((x, y), str(val), fill=(0,0,0), font=font)
+def _base_layer(template, plan, base_ops, data, mode="RGB"):
+    deps = sorted(set().union(*(op.depends_on for op in base_ops)))
+    # a hoisted image is keyed by its content too: the same URL can serve a new body
+    # after revalidation, or recover from a failed fetch
+    images = tuple(_image_version(op.resolve(data)) for op in base_ops if op.kind == "image")
+    key = (plan_cache_key(template), mode, tuple((k, str(data.get(k) or "")) for k in deps), images)
+    base = _base_layers.get(key)
+    if base is None:
+        base = _canvas((plan.width, plan.height), mode)
+        draw = ImageDraw.Draw(base)
+        for op in base_ops:
+            _draw_op(base, draw, op, data)
+        if template.pk is not None:
+            _base_layers.set(key, base)
+    return base
 
-        elif t == "image":
-            url = data.get(key)
-            thumb = _load_image_from_url(url, (w, h)) if url else _load_image_from_url("", (w, h))
-            img.alpha_composite(thumb, (x, y))
+# Bump when a change makes the renderer draw different pixels for the same
+# input, so stored render hashes (LabelInstance.render_hash) stop matching.
+RENDERER_VERSION = 2   # 2: spec quiet zones around barcodes
 
-        elif t == "barcode":
-            val = data.get(key) or data.get("sku") or "CODE"
-            bc = _draw_barcode(str(val), (w, h))
-            img.alpha_composite(bc, (x, y))
+def render_options():
+    """Everything besides template and data that affects the rendered pixels."""
+    return (RENDERER_VERSION, barcode_renderer(), barcode_quiet_override(), qr_error_level())
 
-        elif t == "qrcode":
-            val = data.get(key) or data.get("sku") or "QR"
-            qr = _draw_qr(str(val), (w, h))
-            img.alpha_composite(qr, (x, y))
+def render_label_to_image(template, data: dict, static_keys=frozenset(), mode="RGB"):
+    """
+    Return a PIL Image using the template's compiled render plan and data keys.
 
-    return img.convert("RGB")
+    `static_keys` names data keys whose value is the same for every label of
+    the current run; elements reading only those keys come from the cached base layer.
+    `mode` is "RGB", or "L"/"1" for a monochrome label (see RENDER_MODES).
+    """
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {mode!r}")
+    with span("render"):
+        with span("plan"):
+            plan = get_render_plan(template)
+        urls = image_urls(plan, [data])
+        if len(set(urls)) > 1:
+            with span("image.prefetch"):
+                prefetch(urls)  # e.g. logo + product image: fetch side by side
+        base_ops, variable_ops = split_static(plan, frozenset(static_keys))
+        with span("canvas"):
+            if base_ops:
+                img = _base_layer(template, plan, base_ops, data, mode).copy()
+            else:
+                img = _canvas((plan.width, plan.height), mode)
+        draw = ImageDraw.Draw(img)
+
+        for op in variable_ops:
+            _draw_op(img, draw, op, data)
+
+        if mode != "RGB":
+            return img
+        with span("convert"):
+            return img.convert("RGB")
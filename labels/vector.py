@@ -0,0 +1,213 @@
+"""
+Vector output (SVG / PDF) for a template, from the same compiled render plan
+the raster renderer uses.
+
+Text, barcode bars and QR modules become drawing primitives instead of pixels,
+so the output stays sharp at any printer resolution and a label is a few KB.
+Geometry is kept in the plan's pixel units (template dpi) and scaled to the
+physical label size; only image elements are embedded as bitmaps.
+"""
+import base64, io, zlib
+from xml.sax.saxutils import escape, quoteattr
+from .plans import get_render_plan
+from .pdf import PT_PER_MM, _PdfWriter
+from .images import load_image, ImageFetchError
+from .utils import (
+    barcode_modules, barcode_fit, bar_runs, qr_matrix, qr_error_level, font_for,
+)
+
+FORMATS = {
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+}
+
+def _ascent(op):
+    """Baseline offset for a text op: raster text is placed by its top edge, vector text by its baseline."""
+    try:
+        return font_for(op.font_family, op.font_size).getmetrics()[0]
+    except Exception:
+        return round(op.font_size * 0.8)
+
+# ---- shared geometry ---------------------------------------------------------
+# Rectangles are (x, y, w, h) in plan pixels with a top-left origin; both
+# writers draw exactly these, so SVG and PDF agree with each other.
+
+def barcode_shapes(op, value):
+    """(bar rects, (text, x_center, baseline, size) or None) for a barcode op."""
+    try:
+        pattern, text, quiet = barcode_modules(value)
+    except Exception:
+        return [], None
+    text_h = op.h // 5 if op.h >= 40 else 0
+    bar_h = op.h - text_h
+    module, offset = barcode_fit(op.w, len(pattern), quiet, whole=False)
+    left = op.x + offset
+    rects = [(left + start * module, op.y, run * module, bar_h) for start, run in bar_runs(pattern)]
+    label = None
+    if text_h:
+        size = max(6, text_h - 2)
+        label = (text, op.x + op.w / 2, op.y + bar_h + size * 0.8, size)
+    return rects, label
+
+def qr_shapes(op, value):
+    """Dark-module rects for a QR op, one per horizontal run."""
+    try:
+        matrix = qr_matrix(value, qr_error_level())
+    except Exception:
+        return []
+    n = len(matrix)
+    scale = min(op.w, op.h) / n
+    left = op.x + (op.w - n * scale) / 2
+    top = op.y + (op.h - n * scale) / 2
+    rects = []
+    for r, row in enumerate(matrix):
+        c = 0
+        while c < n:
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < n and row[c]:
+                c += 1
+            rects.append((left + start * scale, top + r * scale, (c - start) * scale, scale))
+    return rects
+
+def _image(url, size):
+    """RGBA image for an image op, or None (the writers draw a placeholder box)."""
+    if not url:
+        return None
+    try:
+        return load_image(url, size)
+    except ImageFetchError:
+        return None
+
+# ---- SVG ---------------------------------------------------------------------
+
+def _fmt(v):
+    return f"{v:.2f}".rstrip("0").rstrip(".")
+
+def _svg_rects(rects):
+    # one path per element keeps files small for dense QR codes
+    d = "".join(f"M{_fmt(x)} {_fmt(y)}h{_fmt(w)}v{_fmt(h)}h{_fmt(-w)}z" for x, y, w, h in rects)
+    return f'<path d="{d}" fill="#000"/>' if d else ""
+
+def render_label_to_svg(template, data):
+    """Return the label as an SVG document (str) sized in millimetres."""
+    plan = get_render_plan(template)
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_fmt(template.width_mm)}mm" '
+        f'height="{_fmt(template.height_mm)}mm" viewBox="0 0 {plan.width} {plan.height}">',
+        f'<rect width="{plan.width}" height="{plan.height}" fill="#fff"/>',
+    ]
+    for op in plan.ops:
+        val = op.resolve(data)
+        if op.kind == "text":
+            family = quoteattr(f"{op.font_family or 'DejaVu Sans'}, sans-serif")
+            out.append(
+                f'<text x="{op.x}" y="{op.y + _ascent(op)}" font-family={family} '
+                f'font-size="{op.font_size}" fill="#000" xml:space="preserve">{escape(val)}</text>'
+            )
+        elif op.kind == "image":
+            img = _image(val, (op.w, op.h))
+            if img is None:
+                out.append(f'<rect x="{op.x}" y="{op.y}" width="{op.w}" height="{op.h}" '
+                           f'fill="#f0f0f0" stroke="#b4b4b4"/>')
+            else:
+                buf = io.BytesIO()
+                img.save(buf, format="PNG")
+                uri = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+                out.append(f'<image x="{op.x}" y="{op.y}" width="{op.w}" height="{op.h}" href="{uri}"/>')
+        elif op.kind == "barcode":
+            rects, label = barcode_shapes(op, val)
+            out.append(_svg_rects(rects))
+            if label:
+                text, cx, baseline, size = label
+                out.append(f'<text x="{_fmt(cx)}" y="{_fmt(baseline)}" text-anchor="middle" '
+                           f'font-family="DejaVu Sans, sans-serif" font-size="{size}">{escape(text)}</text>')
+        elif op.kind == "qrcode":
+            out.append(_svg_rects(qr_shapes(op, val)))
+    out.append("</svg>")
+    return "\n".join(s for s in out if s)
+
+# ---- PDF ---------------------------------------------------------------------
+# Text uses the standard Helvetica font (no embedding, WinAnsi encoding);
+# characters outside cp1252 print as "?".
+
+def _pdf_text(s):
+    raw = s.encode("cp1252", "replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+def render_label_to_pdf(template, data):
+    """Return the label as a one-page PDF (bytes) of the template's physical size."""
+    plan = get_render_plan(template)
+    k = 72 / plan.dpi                      # plan px -> pt
+    page_w = template.width_mm * PT_PER_MM
+    page_h = template.height_mm * PT_PER_MM
+
+    def rect_ops(rects):
+        return "".join(
+            f"{x * k:.2f} {page_h - (y + h) * k:.2f} {w * k:.2f} {h * k:.2f} re\n" for x, y, w, h in rects
+        ) + ("f\n" if rects else "")
+
+    buf = io.BytesIO()
+    pdf = _PdfWriter(buf)
+    font_id = pdf.write(pdf.reserve(), "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                                       "/Encoding /WinAnsiEncoding >>")
+    xobjects = {}
+    content = [b"0 g\n"]
+
+    for op in plan.ops:
+        val = op.resolve(data)
+        if op.kind == "text":
+            if val:
+                content.append(
+                    f"BT /F1 {op.font_size * k:.2f} Tf {op.x * k:.2f} {page_h - (op.y + _ascent(op)) * k:.2f} Td (".encode()
+                    + _pdf_text(val) + b") Tj ET\n"
+                )
+        elif op.kind == "image":
+            img = _image(val, (op.w, op.h))
+            box = f"{op.x * k:.2f} {page_h - (op.y + op.h) * k:.2f} {op.w * k:.2f} {op.h * k:.2f}"
+            if img is None:
+                content.append(f"q 0.94 g 0.71 G 0.5 w {box} re B Q\n".encode())
+                continue
+            smask = pdf.write(pdf.reserve(), (
+                f"/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} "
+                f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode"
+            ), stream=zlib.compress(img.getchannel("A").tobytes()))
+            oid = pdf.write(pdf.reserve(), (
+                f"/Type /XObject /Subtype /Image /Width {img.width} /Height {img.height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode /SMask {smask} 0 R"
+            ), stream=zlib.compress(img.convert("RGB").tobytes()))
+            xobjects[f"Im{oid}"] = oid
+            content.append(f"q {op.w * k:.2f} 0 0 {op.h * k:.2f} {box.rsplit(' ', 2)[0]} cm /Im{oid} Do Q\n".encode())
+        elif op.kind == "barcode":
+            rects, label = barcode_shapes(op, val)
+            content.append(rect_ops(rects).encode())
+            if label:
+                text, cx, baseline, size = label
+                # Helvetica digits/capitals average ~0.6 em; close enough to centre the caption
+                x = cx - len(text) * size * 0.3
+                content.append(
+                    f"BT /F1 {size * k:.2f} Tf {x * k:.2f} {page_h - baseline * k:.2f} Td (".encode()
+                    + _pdf_text(text) + b") Tj ET\n"
+                )
+        elif op.kind == "qrcode":
+            content.append(rect_ops(qr_shapes(op, val)).encode())
+
+    cid = pdf.write(pdf.reserve(), "/Filter /FlateDecode", stream=zlib.compress(b"".join(content)))
+    xobj = " ".join(f"/{name} {oid} 0 R" for name, oid in xobjects.items())
+    page = pdf.write(pdf.reserve(), (
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+        f"/Resources << /Font << /F1 {font_id} 0 R >> /XObject << {xobj} >> >> /Contents {cid} 0 R >>"
+    ))
+    pdf.close([page])
+    return buf.getvalue()
+
+def render_label_vector(template, data, fmt):
+    """(bytes, content type) for fmt in FORMATS."""
+    if fmt == "svg":
+        return render_label_to_svg(template, data).encode("utf-8"), FORMATS["svg"]
+    if fmt == "pdf":
+        return render_label_to_pdf(template, data), FORMATS["pdf"]
+    raise ValueError(f"Unknown vector format {fmt!r}; choose one of {', '.join(FORMATS)}.")
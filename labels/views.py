@@ -1,25 +1,41 @@
 # labels/views.py
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
 from django.contrib import messages
-import csv, io, json, os, uuid
+import csv, io, json, uuid
 from django.conf import settings
 from workspaces.models import Workspace
 from organizations.models import Membership
-from .models import LabelTemplate, LabelField, LabelInstance
-from .utils import render_label_to_image
+from .models import LabelTemplate, LabelField, LabelInstance, RenderJob, SerialCounter
+from .plans import get_render_plan
+from .services import (
+    template_field_defs, collect_schema_code_fields, build_payload,
+    render_hash, existing_rendered_files, render_label_file, create_label_instances,
+)
+from .bulk import generate_from_csv, read_csv_rows, BulkResult, RowError
+from .jobs import enqueue_job, job_status
+from .pdf import SheetLayout, SHEETS
+from .vector import render_label_vector, FORMATS as VECTOR_FORMATS
+from .zpl import render_label_to_zpl, CONTENT_TYPE as ZPL_CONTENT_TYPE, PRINTER_DPIS
+from .archive import iter_label_zip
+from .output import get_profile, CHOICES as OUTPUT_CHOICES
+from .pagination import KeysetPage, count_estimate
+from .search import search_instances
+from . import timing
 from django.db import models
-from django.core.paginator import Paginator
+from django.utils.text import slugify
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
 def _current_workspace(request):
-    ws_id = request.session.get("current_workspace_id")
-    if not ws_id:
-        return None
-    try:
-        return Workspace.objects.select_related("organization").get(id=ws_id)
-    except Workspace.DoesNotExist:
-        return None
+    return request.workspace  # set by core.middleware.CurrentWorkspaceMiddleware
+
+def _with_server_timing(response, stages):
+    """Expose the render stages of this request as a Server-Timing header (when timing is on)."""
+    if stages:
+        response["Server-Timing"] = timing.server_timing(stages)
+    return response
 
 @login_required
 def generate_choose_template(request):
@@ -39,79 +55,37 @@ def generate_single(request, pk: int):
     tmpl = get_object_or_404(LabelTemplate, id=pk, is_active=True)
 
     # Build form field list (TEXT + IMAGE from fields or schema)
-    field_defs = []
-    fields_qs = tmpl.fields.order_by("sort_order")
-    if fields_qs.exists():
-        for f in fields_qs:
-            if f.field_type in ("TEXT", "IMAGE"):
-                field_defs.append({"key": f.key, "name": f.name, "type": f.field_type})
-    else:
-        # derive from schema for custom
-        schema = tmpl.schema or {}
-        if isinstance(schema, str):
-            try:
-                schema = json.loads(schema)
-            except Exception:
-                schema = {}
-        for el in (schema or {}).get("elements", []):
-            if el.get("type") in ("text", "image"):
-                key = (el.get("dataKey") or "").strip()
-                if key:
-                    field_defs.append({
-                        "key": key,
-                        "name": key.replace("_", " ").title(),
-                        "type": "IMAGE" if el.get("type") == "image" else "TEXT"
-                    })
-
-    # Sort & dedupe by key
-    seen, deduped = set(), []
-    for f in field_defs:
-        if f["key"] not in seen:
-            deduped.append(f)
-            seen.add(f["key"])
-    field_defs = deduped
+    field_defs = template_field_defs(tmpl)
 
     # NEW: discover code fields from schema (for custom templates)
-    code_fields = _collect_schema_code_fields(tmpl)
+    code_fields = collect_schema_code_fields(tmpl)
 
     if request.method == "POST":
-        payload = {}
-        # TEXT / IMAGE inputs
-        for f in field_defs:
-            payload[f["key"]] = (request.POST.get(f["key"]) or "").strip()
-
-        # NEW: add code values from schema-discovered code fields
-        for cf in code_fields:
-            payload[cf["key"]] = (request.POST.get(cf["key"]) or "").strip()
-
-        # Backward-compat: premade templates can still send a single code_value/code_type
-        code_type = (request.POST.get("code_type") or "BARCODE").upper()
-        code_value = (request.POST.get("code_value") or "") or payload.get("sku") or ""
-        if code_value:
-            # If template expects 'code_value', ensure it's present
-            payload.setdefault("code_value", code_value)
-
-        # Render & save
-        img = render_label_to_image(tmpl, payload)
-
-        # Persist instance
-        instance = LabelInstance.objects.create(
-            workspace=ws, template=tmpl, created_by=request.user, data=payload
-        )
-        out_dir = os.path.join(settings.MEDIA_ROOT, "labels", str(ws.id), "instances")
-        os.makedirs(out_dir, exist_ok=True)
-        out_path = os.path.join(out_dir, f"{instance.id}.png")
-        img.save(out_path, "PNG")
-        instance.png_path = os.path.relpath(out_path, settings.MEDIA_ROOT).replace("\\", "/")
-        instance.save(update_fields=["png_path"])
+        payload = build_payload(request.POST, field_defs, code_fields)
+        profile = get_profile(request.POST.get("output_format"), tmpl)
+
+        if getattr(settings, "LABELS_RENDER_ASYNC", False):
+            job = enqueue_job(tmpl, ws, request.user, [(1, payload)], output_format=profile.key)
+            return redirect("labels:job_detail", pk=job.id)
+
+        # Render & save (a reprint of the same template version + data reuses the earlier file)
+        with timing.collect() as stages:
+            with timing.span("hash"):
+                digest = render_hash(tmpl, payload, profile)
+                existing = existing_rendered_files(ws, [digest]).get(digest)
+            blob = None if existing else render_label_file(tmpl, payload, profile)
+            with timing.span("store"):
+                instance = create_label_instances(tmpl, ws, request.user, [(payload, digest, blob, existing)], profile)[0]
 
         messages.success(request, "Label generated.")
-        return render(request, "labels/generate_result.html", {"instance": instance, "template": tmpl})
+        response = render(request, "labels/generate_result.html", {"instance": instance, "template": tmpl})
+        return _with_server_timing(response, stages)
 
     return render(request, "labels/generate_single.html", {
         "template": tmpl,
         "field_defs": field_defs,
         "code_fields": code_fields,   # <-- pass to template
+        "output_choices": OUTPUT_CHOICES,
     })
 
 
@@ -143,17 +117,18 @@ def template_create(request):
         width_mm = float(request.POST.get("width_mm") or 50)
         height_mm = float(request.POST.get("height_mm") or 30)
         dpi = int(request.POST.get("dpi") or 300)
+        output_format = get_profile(request.POST.get("output_format")).key
         if not name:
             messages.error(request, "Template name is required.")
             return redirect("labels:template_create")
         tmpl = LabelTemplate.objects.create(
             workspace=ws, name=name, kind=LabelTemplate.Kind.CUSTOM,
-            width_mm=width_mm, height_mm=height_mm, dpi=dpi,
+            width_mm=width_mm, height_mm=height_mm, dpi=dpi, output_format=output_format,
             schema={"elements": []}, created_by=request.user
         )
         messages.success(request, "Template created. You can now design it.")
         return redirect("labels:template_editor", pk=tmpl.id)
-    return render(request, "labels/template_create.html", {"workspace": ws})
+    return render(request, "labels/template_create.html", {"workspace": ws, "output_choices": OUTPUT_CHOICES})
 
 @login_required
 def template_editor(request, pk: int):
@@ -162,7 +137,9 @@ def template_editor(request, pk: int):
     # ensure workspace ownership for custom templates
     if tmpl.kind == LabelTemplate.Kind.CUSTOM and tmpl.workspace_id != (ws.id if ws else None):
         return redirect("workspaces:choose")
-    return render(request, "labels/template_editor.html", {"workspace": ws, "template": tmpl})
+    return render(request, "labels/template_editor.html", {
+        "workspace": ws, "template": tmpl, "output_choices": OUTPUT_CHOICES,
+    })
 
 @login_required
 def template_save_schema(request, pk: int):
@@ -181,8 +158,15 @@ def template_save_schema(request, pk: int):
             return JsonResponse({"ok": False, "error": "Invalid schema"}, status=400)
     except Exception as e:
         return JsonResponse({"ok": False, "error": f"Bad JSON: {e}"}, status=400)
+    output_format = request.POST.get("output_format")
+    if output_format is not None and output_format not in dict(OUTPUT_CHOICES):
+        return JsonResponse({"ok": False, "error": "Unknown output format"}, status=400)
     tmpl.schema = {"elements": parsed}
-    tmpl.save(update_fields=["schema", "updated_at"])
+    update_fields = ["schema", "updated_at"]
+    if output_format:
+        tmpl.output_format = output_format
+        update_fields.append("output_format")
+    tmpl.save(update_fields=update_fields)
     return JsonResponse({"ok": True})
 
 @login_required
@@ -192,33 +176,6 @@ def template_preview(request, pk: int):
     fields = tmpl.fields.order_by("sort_order")
     return render(request, "labels/template_preview.html", {"template": tmpl, "fields": fields})
 
-def _collect_schema_code_fields(template):
-    """Look into template.schema and return [{kind, key, label}] for barcode/qrcode elements."""
-    schema = template.schema or {}
-    if isinstance(schema, str):
-        try:
-            schema = json.loads(schema)
-        except Exception:
-            schema = {}
-    els = (schema or {}).get("elements", []) or []
-
-    code_fields, seen = [], set()
-    for idx, el in enumerate(els):
-        t = (el or {}).get("type")
-        if t not in ("barcode", "qrcode"):
-            continue
-        key = (el or {}).get("dataKey") or f"{t}_value_{idx+1}"  # fallback key if designer forgot one
-        tag = ("BARCODE" if t == "barcode" else "QRCODE", key)
-        if tag in seen:
-            continue
-        seen.add(tag)
-        code_fields.append({
-            "kind": tag[0],
-            "key": key,
-            "label": f"{'Barcode' if t=='barcode' else 'QR'} value ({key})",
-        })
-    return code_fields
-
 @login_required
 def template_csv(request, pk: int):
     tmpl = get_object_or_404(LabelTemplate, id=pk, is_active=True)
@@ -232,12 +189,9 @@ def template_csv(request, pk: int):
                 headers.append(f.key)
     else:
         # Custom: derive from schema elements (TEXT & IMAGE, with dataKey)
-        schema = tmpl.schema or {}
-        for el in (schema.get("elements") or []):
-            if el.get("type") in ("text","image"):
-                key = (el.get("dataKey") or "").strip()
-                if key:
-                    headers.append(key)
+        headers += [key for key, _type in get_render_plan(tmpl).input_fields]
+        # ...plus one column per barcode/qrcode so the same file feeds bulk generation
+        headers += [cf["key"] for cf in collect_schema_code_fields(tmpl)]
 
     headers = list(dict.fromkeys(headers))  # dedupe, preserve order
     if not headers:
@@ -252,6 +206,53 @@ def template_csv(request, pk: int):
     resp["Content-Disposition"] = f'attachment; filename="{safe_name}_format.csv"'
     return resp
 
+@login_required
+def label_export(request, pk: int, fmt: str):
+    """Re-render a generated label from its stored data as SVG/PDF vectors or printer ZPL."""
+    ws = _current_workspace(request)
+    if not ws:
+        return redirect("workspaces:choose")
+    if fmt not in VECTOR_FORMATS and fmt != "zpl":
+        return HttpResponseBadRequest("Unknown format")
+    inst = get_object_or_404(LabelInstance.objects.select_related("template"), id=pk, workspace=ws)
+    if fmt == "zpl":
+        dpi = request.GET.get("dpi")   # printer resolution, e.g. ?dpi=203
+        if dpi:
+            if not dpi.isdigit() or int(dpi) not in PRINTER_DPIS:
+                return HttpResponseBadRequest("dpi must be one of " + ", ".join(map(str, PRINTER_DPIS)))
+            dpi = int(dpi)
+        else:
+            dpi = None
+        body, content_type = render_label_to_zpl(inst.template, inst.data or {}, dpi=dpi), ZPL_CONTENT_TYPE
+    else:
+        body, content_type = render_label_vector(inst.template, inst.data or {}, fmt)
+    resp = HttpResponse(body, content_type=content_type)
+    name = f"{slugify(inst.template.name) or 'label'}_{inst.serial_no or inst.id}.{fmt}"
+    resp["Content-Disposition"] = f'attachment; filename="{name}"'
+    return resp
+
+def _filter_instances(request, qs):
+    """Apply the history filters in request.GET: q, mine, template, date_from/date_to, serial_from/serial_to."""
+    params = request.GET
+    if (params.get("q") or "").strip():
+        qs = search_instances(qs, params["q"])
+    # Optional filter: ?mine=1 shows only current user's labels in this workspace
+    if params.get("mine") == "1":
+        qs = qs.filter(created_by=request.user)
+    if (params.get("template") or "").isdigit():
+        qs = qs.filter(template_id=int(params["template"]))
+    date_from = parse_date(params.get("date_from") or "")
+    date_to = parse_date(params.get("date_to") or "")
+    if date_from:
+        qs = qs.filter(created_at__date__gte=date_from)
+    if date_to:
+        qs = qs.filter(created_at__date__lte=date_to)
+    if (params.get("serial_from") or "").isdigit():
+        qs = qs.filter(serial_no__gte=int(params["serial_from"]))
+    if (params.get("serial_to") or "").isdigit():
+        qs = qs.filter(serial_no__lte=int(params["serial_to"]))
+    return qs
+
 @login_required
 def history(request):
     ws = _current_workspace(request)
@@ -264,13 +265,113 @@ def history(request):
         .filter(workspace=ws)
         .order_by("-created_at", "-id")
     )
+    qs = _filter_instances(request, qs)
 
-    # Optional filter: ?mine=1 shows only current user's labels in this workspace
-    if request.GET.get("mine") == "1":
-        qs = qs.filter(created_by=request.user)
+    # keyset pages: ?after=<cursor> for older labels, ?before=<cursor> for newer ones
+    page_obj = KeysetPage(qs, per_page=25, after=request.GET.get("after"), before=request.GET.get("before"))
+
+    filters = request.GET.copy()
+    for param in ("page", "after", "before"):
+        filters.pop(param, None)
+    if filters:
+        total = count_estimate(qs, (ws.id, request.user.id, sorted(filters.lists())))
+    else:
+        # serials are handed out consecutively, so the counter is the workspace total (minus deletions)
+        counter = SerialCounter.objects.filter(workspace=ws).values_list("next_serial", flat=True).first()
+        total = (counter - 1) if counter else count_estimate(qs, (ws.id,))
+    templates = LabelTemplate.objects.filter(
+        models.Q(workspace__isnull=True) | models.Q(workspace=ws)
+    ).order_by("kind", "name")
+    return render(request, "labels/history.html", {
+        "page_obj": page_obj, "workspace": ws, "templates": templates,
+        "filters": filters.urlencode(), "total": total,
+    })
+
+@login_required
+def history_zip(request):
+    """Stream a ZIP of the PNGs matching the history filters (never built in memory)."""
+    ws = _current_workspace(request)
+    if not ws:
+        return redirect("workspaces:choose")
+    qs = _filter_instances(request, LabelInstance.objects.filter(workspace=ws))
+    qs = (
+        qs.select_related("template")
+        .only("id", "serial_no", "png_path", "data", "created_at", "template__name")
+        .order_by("serial_no", "id")
+    )
+    resp = StreamingHttpResponse(iter_label_zip(qs.iterator(chunk_size=500)), content_type="application/zip")
+    name = f"labels_{slugify(ws.name) or ws.id}_{timezone.now():%Y%m%d_%H%M%S}.zip"
+    resp["Content-Disposition"] = f'attachment; filename="{name}"'
+    return resp
 
-    paginator = Paginator(qs, 25)
-    page = request.GET.get("page") or 1
-    page_obj = paginator.get_page(page)
+@login_required
+def generate_bulk(request, pk: int):
+    ws = _current_workspace(request)
+    if not ws:
+        return redirect("workspaces:choose")
+    # premade templates, or custom ones of this workspace
+    tmpl = get_object_or_404(
+        LabelTemplate.objects.filter(models.Q(workspace__isnull=True) | models.Q(workspace=ws)), id=pk, is_active=True
+    )
 
-    return render(request, "labels/history.html", {"page_obj": page_obj, "workspace": ws})
+    if request.method == "POST":
+        upload = request.FILES.get("csv_file")
+        if not upload:
+            messages.error(request, "Please choose a CSV file.")
+            return redirect("labels:generate_bulk", pk=tmpl.id)
+        sheet = (request.POST.get("sheet") or "").upper()
+        layout = SheetLayout(sheet=sheet) if sheet in SHEETS else None
+        output = get_profile(request.POST.get("output_format"), tmpl).key
+        try:
+            if getattr(settings, "LABELS_RENDER_ASYNC", False):
+                job = enqueue_job(tmpl, ws, request.user, read_csv_rows(tmpl, upload), sheet_layout=layout,
+                                  output_format=output)
+                return redirect("labels:job_detail", pk=job.id)
+            with timing.collect() as stages:
+                result = generate_from_csv(tmpl, ws, request.user, upload, sheet_layout=layout, output=output)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect("labels:generate_bulk", pk=tmpl.id)
+
+        if result.created:
+            messages.success(request, f"{result.created} label(s) generated.")
+        if result.failed:
+            messages.warning(request, f"{result.failed} row(s) could not be generated.")
+        response = render(request, "labels/generate_bulk_result.html", {"template": tmpl, "result": result})
+        return _with_server_timing(response, stages)
+
+    return render(request, "labels/generate_bulk.html", {
+        "template": tmpl, "sheets": list(SHEETS), "output_choices": OUTPUT_CHOICES,
+    })
+
+@login_required
+def job_status_view(request, pk: int):
+    ws = _current_workspace(request)
+    if not ws:
+        return JsonResponse({"ok": False, "error": "No workspace selected"}, status=400)
+    job = get_object_or_404(RenderJob, id=pk, workspace=ws)
+    return JsonResponse(dict(job_status(job), ok=True))
+
+@login_required
+def job_detail(request, pk: int):
+    ws = _current_workspace(request)
+    if not ws:
+        return redirect("workspaces:choose")
+    job = get_object_or_404(RenderJob.objects.select_related("template"), id=pk, workspace=ws)
+    if job.status == RenderJob.Status.DONE:
+        if job.total == 1 and len(job.instance_ids) == 1:
+            instance = get_object_or_404(LabelInstance, id=job.instance_ids[0])
+            return render(request, "labels/generate_result.html", {"instance": instance, "template": job.template})
+        result = BulkResult(
+            created=len(job.instance_ids), instance_ids=job.instance_ids, pdf_path=job.pdf_path,
+            errors=[RowError(**e) for e in job.errors],
+        )
+        return render(request, "labels/generate_bulk_result.html", {"template": job.template, "result": result})
+    return render(request, "labels/job_detail.html", {"job": job, "status": job_status(job)})
+
+@login_required
+def render_timings(request):
+    """Per-stage render timing histograms of this process (staff only)."""
+    if not request.user.is_staff:
+        return JsonResponse({"ok": False, "error": "Staff only"}, status=403)
+    return JsonResponse(dict(timing.snapshot(), ok=True))
@@ -5,9 +5,11 @@ from .models import Organization, Membership
 class OrganizationAdmin(admin.ModelAdmin):
     list_display = ("name", "domain", "kind", "created_by", "created_at")
     search_fields = ("name", "domain")
+    list_select_related = ("created_by",)
 
 @admin.register(Membership)
 class MembershipAdmin(admin.ModelAdmin):
     list_display = ("user", "organization", "role", "status", "created_at")
     list_filter = ("role", "status", "organization")
     search_fields = ("user__email", "organization__domain")
+    list_select_related = ("user", "organization")
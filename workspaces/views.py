@@ -63,13 +63,7 @@ def select_workspace(request, workspace_id: int):
     return redirect("accounts:post_login")
 
 def _current_workspace(request):
-    ws_id = request.session.get("current_workspace_id")
-    if not ws_id:
-        return None
-    try:
-        return Workspace.objects.select_related("organization").get(id=ws_id)
-    except Workspace.DoesNotExist:
-        return None
+    return request.workspace  # set by core.middleware.CurrentWorkspaceMiddleware
 
 @login_required
 def create_workspace(request):